@@ -1,8 +1,55 @@
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, Response, abort, jsonify, render_template, request, send_file, send_from_directory
 app = Flask(__name__)
 
-import uuid
+import concurrent.futures
+import os
 import rnote_for_webapp as rnote
+from src import imagecache
+from src import livepreview
+from src.pdfcache import PdfCache
+from src.renderqueue import NoteRejected, QueueFull, RenderQueue
+
+# Compiled PDFs, reused when the same note is compiled again. PDFs that go
+# unused are deleted by a background sweeper
+pdf_cache = PdfCache('temp',
+    max_entries=int(os.environ.get('RNOTE_PDF_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('RNOTE_PDF_CACHE_BYTES', 256 * 1024 * 1024)),
+    max_age=float(os.environ.get('RNOTE_PDF_CACHE_MAX_AGE', 24 * 60 * 60)))
+pdf_cache.startSweeper(float(os.environ.get('RNOTE_PDF_CACHE_SWEEP', 60)))
+
+# Worker processes that notes are compiled in. Notes over the size, line or
+# image limits are turned away, and each render is killed if it goes over its
+# time or memory budget. Jobs, like the PDF cache, only live in this process's
+# memory, so the app runs as a single gunicorn worker (see the Procfile) and
+# renders are spread over these processes instead
+render_queue = RenderQueue(pdf_cache, rnote.run,
+    max_workers=int(os.environ.get('RNOTE_RENDER_WORKERS', 2)),
+    max_pending=int(os.environ.get('RNOTE_RENDER_QUEUE', 8)),
+    max_bytes=int(os.environ.get('RNOTE_MAX_NOTE_BYTES', 512 * 1024)),
+    max_lines=int(os.environ.get('RNOTE_MAX_NOTE_LINES', 20000)),
+    max_images=int(os.environ.get('RNOTE_MAX_NOTE_IMAGES', 20)),
+    timeout=float(os.environ.get('RNOTE_RENDER_TIMEOUT', 30)),
+    max_memory=int(os.environ.get('RNOTE_RENDER_MEMORY_MB', 1024)) * 1024 * 1024,
+    preload=['src.renderworker'])
+
+# Images downloaded by renders. Each render only lives for one note, so the
+# cache's limits are enforced here, and unfinished downloads left by renders
+# that were killed are swept up
+image_cache = imagecache.sharedCache()
+image_cache.startSweeper(float(os.environ.get('RNOTE_IMAGE_CACHE_SWEEP', 60)))
+
+# Form encoding can make a note up to three times larger, so request bodies
+# well past that are refused before they are even read
+app.config['MAX_CONTENT_LENGTH'] = 4 * render_queue.max_bytes
+
+# Seconds clients are asked to wait before retrying when the queue is full
+RETRY_AFTER = int(os.environ.get('RNOTE_RETRY_AFTER', 5))
+
+# Seconds /api/compile waits for a render before giving up on it
+API_TIMEOUT = float(os.environ.get('RNOTE_API_TIMEOUT', 60))
+
+# Most pages a draft preview from /api/compile may have
+MAX_PREVIEW_PAGES = 10
 
 DEFAULT_TEXT = """// Enter your note below and click 'compile' to generate it!
 .pp theme modern
@@ -20,13 +67,67 @@ def index():
         return render_template('index.html', pdf_filename='./out', code=DEFAULT_TEXT)
 
     elif request.method == 'POST':
-        # Get the "code" and generate a new filename with a UUID
+        # Get the "code" and queue it to be compiled. The page picks up the PDF
+        # once it is ready, unless it has been compiled already
         code = request.form['code']
-        filename = 'temp/' + str(uuid.uuid4()) + '.pdf'
+        try: job_id = render_queue.submit(code)
+        except NoteRejected as e:
+            return render_template('index.html', pdf_filename='', code=code, error=str(e)), 413
+        except QueueFull:
+            return render_template('index.html', pdf_filename='', code=code, error='The server is busy, please try compiling again shortly'), 503, {'Retry-After': str(RETRY_AFTER)}
+
+        job = render_queue.status(job_id)
+        if job['status'] == 'done': return render_template('index.html', pdf_filename=job['pdf'], code=code)
+        return render_template('index.html', pdf_filename='', job_id=job_id, code=code)
+
+
+# Gets the status of a compile, waiting up to ?wait= seconds for it to finish
+@app.route('/jobs/<string:job_id>')
+def showJob(job_id):
+    wait = min(request.args.get('wait', 0, type=float), 10)
+    job = render_queue.status(job_id, wait)
+    if job is None: return jsonify(status='unknown'), 404
+    return jsonify(job)
 
-        # Send off the code and filename to be processed
-        rnote.run(code, filename)
-        return render_template('index.html', pdf_filename=filename, code=code)
+
+# Compiles the RNote text in the body of the request, or its code form field,
+# and responds with the PDF itself. Notes that are not cached are rendered in
+# memory and never written to disk. With ?preview=PAGES only a draft of about
+# the first PAGES pages is compiled, unless the whole note is already cached
+@app.route('/api/compile', methods=['POST'])
+def compileApi():
+    code = request.form.get('code', request.get_data(as_text=True))
+    filename = pdf_cache.get(pdf_cache.key(code))
+    if filename is not None: return send_file(filename, mimetype='application/pdf')
+
+    options = {}
+    preview_pages = request.values.get('preview', type=float)
+    if preview_pages is not None: options['preview_pages'] = min(max(preview_pages, 1), MAX_PREVIEW_PAGES)
+
+    try: future = render_queue.renderBytes(code, **options)
+    except NoteRejected as e: return jsonify(status='failed', error=str(e)), 413
+    except QueueFull: return jsonify(status='failed', error='The server is busy, please try compiling again shortly'), 503, {'Retry-After': str(RETRY_AFTER)}
+
+    try: pdf = future.result(timeout=API_TIMEOUT)
+    except concurrent.futures.TimeoutError: return jsonify(status='failed', error='Compiling took longer than {} seconds'.format(API_TIMEOUT)), 504
+    except Exception as e: return jsonify(status='failed', error=str(e)), 500
+    return Response(pdf, mimetype='application/pdf')
+
+
+# Returns the themed HTML of the note in the JSON body of the request, for the
+# editor to show as it is being typed. Blocks and stylesheets whose ids are
+# sent in have and css_id are only sent back by id
+@app.route('/api/preview', methods=['POST'])
+def livePreview():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict): data = {}
+    code, have = data.get('code'), data.get('have') or []
+    if not isinstance(code, str): return jsonify(status='failed', error='No note was given'), 400
+    if not isinstance(have, list) or not all(isinstance(block_id, str) for block_id in have):
+        return jsonify(status='failed', error='have must be a list of block ids'), 400
+    try: render_queue.admit(code)
+    except NoteRejected as e: return jsonify(status='failed', error=str(e)), 413
+    return jsonify(livepreview.livePreview(code, have, data.get('css_id')))
 
 
 # Displays the pdf
@@ -41,10 +142,27 @@ def showFavicon():
     return send_from_directory('', 'favicon.ico')    
 
 
-# Display's user's PDF
+# Display's user's PDF. PDFs are named after the hash of what they contain, so
+# browsers may keep them, and revalidate or fetch single pages with ranges
 @app.route('/temp/<string:filename>')
 def displayNewPdf(filename):
-    return send_from_directory('temp', filename)
+    key, ext = os.path.splitext(filename)
+    if ext != '.pdf' or not pdf_cache.touch(key): abort(404)
+
+    response = send_from_directory('temp', filename, conditional=True)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = 24 * 60 * 60
+    return response
+
+
+# Displays the PDF cache counters
+@app.route('/metrics')
+def showMetrics():
+    stats = pdf_cache.stats()
+    lines = ['rnote_pdf_cache_{} {}'.format(name, value) for name, value in stats.items()]
+    lines.append('rnote_render_queue_pending {}'.format(len(render_queue.pending) + len(render_queue.in_memory)))
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
 
 
 # Error handler for 404
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# RNote Backend Comparison
+# Run from the rnote directory with: python -m bench.backends
+from bench import corpus as corpus
+from src import flowables as flowables
+from src import generator as gen
+from src import parser as parser
+from src import pdfcompat as pdfcompat
+from src import styling as sty
+
+import argparse
+import difflib
+import os
+import re
+import sys
+import tempfile
+import time
+
+# Glyphs that bullets are drawn with by either backend, which are not part of
+# the text, and escaped asterisks, which xhtml2pdf draws as a stray '&ast'
+IGNORED = re.compile('[•▪●◦■❍○*]|&ast;?')
+
+def renderPisa(doc: [str], out_file: str) -> float:
+    """ Compiles a document through the HTML middle-man, returning the seconds it took """
+    start_time = time.perf_counter()
+    style = sty.Styler()
+    raw_html = parser.parseRNoteDoc(doc, style, gen.generateHtmlHeader(style))
+    if gen.convertHtmlToPdf(raw_html, style, out_file).err: raise RuntimeError('PDF conversion failed')
+    return time.perf_counter() - start_time
+
+
+def renderReportLab(doc: [str], out_file: str) -> tuple:
+    """ Compiles a document straight into ReportLab, returning the seconds it took and the parsed document """
+    start_time = time.perf_counter()
+    style = sty.Styler()
+    document = parser.buildRNoteDoc(doc, style, flowables.FlowableDocument(style.ctx))
+    flowables.convertToPdf(document, style, out_file)
+    return time.perf_counter() - start_time, document
+
+
+def tableHeaders(document: flowables.FlowableDocument) -> [tuple]:
+    """ Returns the words of the header of each table in a document """
+    return [tuple(IGNORED.sub(' ', re.sub('<[^>]*>', '', ' '.join(head))).split()) for kind, head, *_ in document.blocks if kind == 'table']
+
+
+def dropRuns(words: [str], runs: [tuple]) -> [str]:
+    """Removes every occurrence of some runs of words, used for table headers,
+    which repeat on whichever pages each backend breaks the table across
+    """
+    runs = {r for r in runs if r}
+    kept, i = [], 0
+    while i < len(words):
+        run = next((r for r in runs if tuple(words[i:i + len(r)]) == r), None)
+        if run is None:
+            kept.append(words[i])
+            i += 1
+        else: i += len(run)
+    return kept
+
+
+def readPdf(filename: str) -> tuple:
+    """Reads what is compared between the backends out of a PDF
+
+    Parameters
+    ----------
+    filename
+        Path to the PDF
+
+    Returns
+    -------
+    tuple
+        The number of pages, the size of each page in points and the words of
+        the text in order
+    """
+    reader = pdfcompat.reader(filename)
+    sizes = {tuple(round(l) for l in pdfcompat.pageSize(p)) for p in reader.pages}
+    text = ' '.join(pdfcompat.pageText(p) for p in reader.pages)
+    return len(reader.pages), sizes, IGNORED.sub(' ', text).split()
+
+
+def compareBackends(doc: [str], tmp_dir: str) -> dict:
+    """Compiles a document with both backends and compares the PDFs
+
+    Parameters
+    ----------
+    doc
+        Lines of the document
+
+    tmp_dir
+        Folder to write the PDFs to
+
+    Returns
+    -------
+    dict
+        Timings, page counts and sizes of both PDFs, and how similar their
+        text is apart from table headers
+    """
+    pisa_file, rl_file = os.path.join(tmp_dir, 'pisa.pdf'), os.path.join(tmp_dir, 'reportlab.pdf')
+    pisa_time = renderPisa(doc, pisa_file)
+    rl_time, document = renderReportLab(doc, rl_file)
+    pisa_pages, pisa_sizes, pisa_words = readPdf(pisa_file)
+    rl_pages, rl_sizes, rl_words = readPdf(rl_file)
+    headers = tableHeaders(document)
+    pisa_words, rl_words = dropRuns(pisa_words, headers), dropRuns(rl_words, headers)
+    return {
+        'pisa': {'seconds': pisa_time, 'pages': pisa_pages},
+        'reportlab': {'seconds': rl_time, 'pages': rl_pages},
+        'same_page_size': pisa_sizes == rl_sizes,
+        'text_similarity': difflib.SequenceMatcher(None, pisa_words, rl_words, autojunk=False).ratio()
+    }
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Checks the ReportLab backend against the pisa backend on generated RNote documents')
+    arg_parser.add_argument('-s', '--scales', nargs='+', choices=list(corpus.SCALES), default=['small', 'medium'], help='sizes of document to compare')
+    arg_parser.add_argument('--seeds', type=int, default=5, help='number of documents generated at each scale')
+    arg_parser.add_argument('--min-similarity', type=float, default=0.99, help='fraction of the text that must match for a document to pass')
+    args = arg_parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in args.scales:
+            for seed in range(args.seeds):
+                r = compareBackends(corpus.generateDocument(corpus.SCALES[scale], seed), tmp_dir)
+                print('[RNOTE] {:<8} seed {:<3} pisa {:.4f}s {:>4} pages  reportlab {:.4f}s {:>4} pages  text {:.1%}{}'.format(
+                    scale, seed, r['pisa']['seconds'], r['pisa']['pages'], r['reportlab']['seconds'], r['reportlab']['pages'],
+                    r['text_similarity'], '' if r['same_page_size'] else '  page size differs'))
+                if not r['same_page_size']: failures.append('{} seed {} has a different page size'.format(scale, seed))
+                if r['text_similarity'] < args.min_similarity:
+                    failures.append('{} seed {} only has {:.1%} of its text in common'.format(scale, seed, r['text_similarity']))
+
+    for f in failures: print('[ERR!] ' + f)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# RNote Benchmark Baselines
+# Saving the results of a benchmark, and comparing them against an earlier run
+import json
+import sys
+
+def saveResults(results: dict, filename: str):
+    """ Saves the results of a run as JSON """
+    with open(filename, 'w') as f: json.dump(results, f, indent=2)
+    print('[RNOTE] Results saved to {}'.format(filename))
+
+
+def loadResults(filename: str) -> dict:
+    """ Loads the results of an earlier run """
+    with open(filename) as f: return json.load(f)
+
+
+def compareMedians(medians: dict, baseline: dict, threshold: float) -> [str]:
+    """Compares the median timings of a run against a baseline run
+
+    Parameters
+    ----------
+    medians
+        {name of what was timed: median in seconds} of this run
+
+    baseline
+        {name of what was timed: median in seconds} of the baseline run
+
+    threshold
+        Fraction that a median may grow by before it counts as a regression
+
+    Returns
+    -------
+    [str]
+        A description of each regression, empty if there were none
+    """
+    regressions = []
+    for name, new in medians.items():
+        if name not in baseline: continue
+        old = baseline[name]
+        change = (new - old) / old if old else 0.0
+        print('[RNOTE] {:<17} {:>10.4f}s -> {:>10.4f}s ({:+.1%})'.format(name, old, new, change))
+        if change > threshold: regressions.append('{} is {:.1%} slower than the baseline'.format(name, change))
+    return regressions
+
+
+def exitWithRegressions(regressions: [str]):
+    """ Reports any regressions, exiting with an error if there were some """
+    for r in regressions: print('[ERR!] ' + r)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# RNote Concurrency Check
+# Run from the rnote directory with: python -m bench.concurrency
+from bench import corpus as corpus
+from src import generator as gen
+from src import parser as parser
+from src import styling as sty
+
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse
+import io
+import re
+import sys
+import time
+
+# Paragraphs put between the blocks of each document, naming the document and
+# the line they are on
+MARKER = 'Marker {} line {}'
+MARKER_PATTERN = re.compile(r'Marker (\d+) line (\d+)')
+
+class RecordingDocument(gen.HtmlDocument):
+    """ HtmlDocument that records the line number of its compile's context whenever a marker is added """
+    def __init__(self, style: sty.Styler):
+        super().__init__(style)
+        self.markers = []
+
+
+    def addElement(self, element: str, the_text: str):
+        m = MARKER_PATTERN.search(the_text)
+        if m is not None: self.markers.append((int(m.group(1)), int(m.group(2)), self.ctx.line_no))
+        super().addElement(element, the_text)
+
+
+def markedDocument(index: int, blocks: int) -> [str]:
+    """ Generates a document with its own title, and a marker paragraph after each of its blocks """
+    doc = []
+    for l in corpus.generateDocument(blocks, index):
+        if l.startswith('.pp title'): l = '.pp title Note {}'.format(index)
+        doc.append(l)
+        if l == '':
+            doc += ['= ' + MARKER.format(index, len(doc) + 1), '']
+    return doc
+
+
+def checkCompile(index: int, blocks: int) -> [str]:
+    """Compiles a marked document and checks that nothing from other compiles
+    running at the same time got into it
+
+    Parameters
+    ----------
+    index
+        Number of the document, which is also its seed
+
+    blocks
+        Number of blocks in the document
+
+    Returns
+    -------
+    [str]
+        What was wrong with the compile, if anything
+    """
+    doc = markedDocument(index, blocks)
+    expected = [i + 1 for i, l in enumerate(doc) if l.startswith('= Marker')]
+
+    style = sty.Styler()
+    document = RecordingDocument(style)
+    raw_html = parser.parseRNoteDoc(doc, style, document)
+    pdf = io.BytesIO()
+    status = gen.convertHtmlToPdf(raw_html, style, pdf)
+
+    problems = []
+    if status.err or not pdf.getvalue().startswith(b'%PDF'): problems.append('document {} did not render'.format(index))
+    # Templates put their own text before the title
+    if not document.title.strip().endswith(' Note {}'.format(index)): problems.append('document {} has the title {!r}'.format(index, document.title.strip()))
+    others = {int(i) for i, _ in MARKER_PATTERN.findall(raw_html)} - {index}
+    if others: problems.append('document {} has the body of documents {}'.format(index, sorted(others)))
+    if [line for i, line, _ in document.markers if i == index] != expected: problems.append('document {} lost or reordered its markers'.format(index))
+    for i, line, line_no in document.markers:
+        if line != line_no: problems.append('document {} was on line {} when parsing line {}'.format(index, line_no, line))
+    return problems
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Compiles many generated RNote documents in a thread pool at once and checks that no compile picks up the state of another')
+    arg_parser.add_argument('-n', '--compiles', type=int, default=100, help='number of documents to compile')
+    arg_parser.add_argument('-t', '--threads', type=int, default=16, help='number of compiles running at once')
+    arg_parser.add_argument('-b', '--blocks', type=int, default=10, help='number of blocks in each document')
+    args = arg_parser.parse_args()
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(checkCompile, range(args.compiles), [args.blocks] * args.compiles))
+    failures = [p for r in results for p in r]
+
+    print('[RNOTE] {} compiles in {} threads took {:.4f} seconds, {} of them had problems'.format(
+        args.compiles, args.threads, time.perf_counter() - start_time, sum(1 for r in results if r)))
+    for f in failures: print('[ERR!] ' + f)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,107 @@
+import os
+import random
+
+# Number of blocks in the generated document at each scale
+SCALES = {
+    'small': 40,
+    'medium': 400,
+    'large': 4000
+}
+
+WORDS = ('note', 'lecture', 'page', 'theorem', 'proof', 'example', 'table',
+    'value', 'result', 'point', 'summary', 'chapter', 'review', 'method',
+    'data', 'model', 'graph', 'number', 'list', 'question', 'answer', 'term')
+
+# Inline formatting wrapped around words, always balanced so no warnings print
+MARKUP = ('*{}*', '**{}**', '***{}***', '__{}__', '~~{}~~', '\\*{}', '$date {}')
+
+def themes() -> [str]:
+    """ Returns the names of the themes in the themes/ folder """
+    return sorted(t for t in os.listdir('themes') if os.path.isdir(os.path.join('themes', t)))
+
+
+def templates() -> [str]:
+    """ Returns the names of the templates in the tmplt/ folder """
+    return sorted(os.path.splitext(t)[0] for t in os.listdir('tmplt') if t.endswith('.rntp'))
+
+
+def sentence(rng: random.Random, words: int, markup: float = 0.3) -> str:
+    """Makes a line of random words, some of them formatted
+
+    Parameters
+    ----------
+    rng
+        Random number generator to draw from
+
+    words
+        Number of words in the line
+
+    markup
+        Chance of each word being formatted
+
+    Returns
+    -------
+    str
+        The line of text
+    """
+    line = []
+    for _ in range(words):
+        w = rng.choice(WORDS)
+        if rng.random() < markup: w = rng.choice(MARKUP).format(w)
+        line.append(w)
+    return ' '.join(line)
+
+
+def bullets(rng: random.Random, count: int, max_depth: int = 6) -> [str]:
+    """ Makes a bullet point list that wanders up and down in indentation """
+    lines, depth = [], 1
+    for _ in range(count):
+        depth = max(1, min(max_depth, depth + rng.choice((-1, 0, 1, 1))))
+        lines.append('-' * depth + ' ' + sentence(rng, rng.randint(3, 12)))
+    return lines
+
+
+def table(rng: random.Random, rows: int, cols: int) -> [str]:
+    """ Makes a $table block with formatted cells """
+    lines = ['$table ' + '; '.join(sentence(rng, 1, 0.5) for _ in range(cols))]
+    for _ in range(rows): lines.append('- ' + '; '.join(sentence(rng, rng.randint(1, 3)) for _ in range(cols)))
+    lines.append('$endtable')
+    return lines
+
+
+def generateDocument(blocks: int, seed: int = 0) -> [str]:
+    """Generates an RNote document that uses every part of the format. The same
+    size and seed always give the same document.
+
+    Parameters
+    ----------
+    blocks
+        Number of blocks in the document, not counting preprocessor commands
+
+    seed
+        Seed of the random number generator
+
+    Returns
+    -------
+    [str]
+        Lines of the document
+    """
+    rng = random.Random(seed)
+    doc = [
+        '.pp template ' + rng.choice(templates()),
+        '.pp theme ' + rng.choice(themes()),
+        '.pp title ' + sentence(rng, 4, 0),
+        '# ' + sentence(rng, 5),
+        '@ By ' + sentence(rng, 2, 0) + ' | $date'
+    ]
+
+    for _ in range(blocks):
+        kind = rng.random()
+        if kind < 0.1: doc.append('! ' + sentence(rng, rng.randint(2, 6)))
+        elif kind < 0.4: doc.append('= ' + sentence(rng, rng.randint(10, 60)))
+        elif kind < 0.8: doc += bullets(rng, rng.randint(3, 20))
+        elif kind < 0.9: doc += table(rng, rng.randint(5, 60), rng.randint(2, 6))
+        elif kind < 0.95: doc.append(rng.choice(('$hr', '$br')))
+        else: doc.append('// ' + sentence(rng, 5, 0))
+        doc.append('')
+    return doc
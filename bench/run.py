@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# RNote Benchmarks
+# Run from the rnote directory with: python -m bench.run
+from bench import baseline as baseline
+from bench import corpus as corpus
+from src import generator as gen
+from src import parser as parser
+from src import styling as sty
+
+import argparse
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+def timePhases(doc: [str], out_file: str) -> tuple:
+    """Compiles a document once, timing parsing and PDF conversion separately
+
+    Parameters
+    ----------
+    doc
+        Lines of the document
+
+    out_file
+        Path to write the PDF to
+
+    Returns
+    -------
+    tuple
+        Seconds spent parsing, seconds spent converting and the size of the HTML
+    """
+    start_time = time.perf_counter()
+    style = sty.Styler()
+    raw_html = parser.parseRNoteDoc(doc, style, gen.generateHtmlHeader(style))
+    parse_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    status = gen.convertHtmlToPdf(raw_html, style, out_file)
+    convert_time = time.perf_counter() - start_time
+    if status.err: raise RuntimeError('PDF conversion failed')
+    return parse_time, convert_time, len(raw_html)
+
+
+def summarize(times: [float]) -> dict:
+    """ Returns the fastest and median of a list of timings """
+    return {'min': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+def runScale(scale: str, seed: int, repeat: int) -> dict:
+    """Generates the document of a scale and times compiling it
+
+    Parameters
+    ----------
+    scale
+        One of the names in corpus.SCALES
+
+    seed
+        Seed used to generate the document
+
+    repeat
+        Number of times to compile the document
+
+    Returns
+    -------
+    dict
+        Size of the document and timings of each phase
+    """
+    doc = corpus.generateDocument(corpus.SCALES[scale], seed)
+    parse_times, convert_times = [], []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_file = os.path.join(tmp_dir, 'out.pdf')
+        for _ in range(repeat):
+            parse_time, convert_time, html_bytes = timePhases(doc, out_file)
+            parse_times.append(parse_time)
+            convert_times.append(convert_time)
+        pdf_bytes = os.path.getsize(out_file)
+
+    return {
+        'lines': len(doc),
+        'html_bytes': html_bytes,
+        'pdf_bytes': pdf_bytes,
+        'parse': summarize(parse_times),
+        'convert': summarize(convert_times)
+    }
+
+
+def medians(results: dict) -> dict:
+    """ Returns the median time of each phase of each scale in a run, as {'<scale> <phase>': seconds} """
+    return {'{} {}'.format(scale, phase): phases[phase]['median']
+        for scale, phases in results['scales'].items() for phase in ('parse', 'convert')}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Times parsing and PDF conversion of generated RNote documents')
+    arg_parser.add_argument('-s', '--scales', nargs='+', choices=list(corpus.SCALES), default=['small', 'medium'], help='sizes of document to benchmark')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5, help='number of times each document is compiled')
+    arg_parser.add_argument('--seed', type=int, default=0, help='seed used to generate the documents')
+    arg_parser.add_argument('-o', '--output', help='file to save the results to as JSON')
+    arg_parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    arg_parser.add_argument('--threshold', type=float, default=0.25, help='fraction a median may grow by before it fails the comparison')
+    args = arg_parser.parse_args()
+
+    results = {
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scales': {}
+    }
+    for scale in args.scales:
+        r = results['scales'][scale] = runScale(scale, args.seed, args.repeat)
+        print('[RNOTE] {:<8} {:>7} lines  parse {:.4f}s  convert {:.4f}s (median of {})'.format(
+            scale, r['lines'], r['parse']['median'], r['convert']['median'], args.repeat))
+
+    if args.output: baseline.saveResults(results, args.output)
+
+    if args.baseline:
+        old_results = baseline.loadResults(args.baseline)
+        if old_results.get('seed') != args.seed: print('[WARN] Baseline was generated with a different seed')
+        baseline.exitWithRegressions(baseline.compareMedians(medians(results), medians(old_results), args.threshold))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# RNote Startup Benchmarks
+# Run from the rnote directory with: python -m bench.startup
+from bench import baseline as baseline
+from bench import corpus as corpus
+
+import argparse
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+def commands(doc_file: str, out_file: str) -> dict:
+    """ Returns the commands whose startup is timed, none of which render a PDF """
+    return {
+        'about': [sys.executable, 'rnote', '--about'],
+        'bad-args': [sys.executable, 'rnote', '--no-such-option'],
+        'html': [sys.executable, 'rnote', '-i', doc_file, '-o', out_file, '--html'],
+        'webapp-import': [sys.executable, '-c', 'import rnote_for_webapp']
+    }
+
+
+def medians(results: dict) -> dict:
+    """ Returns the median time of each command in a run, as {command: seconds} """
+    return {name: r['median'] for name, r in results['commands'].items()}
+
+
+def timeCommand(cmd: [str], repeat: int) -> dict:
+    """Runs a command several times, timing each run
+
+    Parameters
+    ----------
+    cmd
+        The command and its arguements
+
+    repeat
+        Number of times to run the command
+
+    Returns
+    -------
+    dict
+        The fastest and median run in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start_time)
+    return {'min': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Times how long RNote takes to start for commands that do not render a PDF')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=10, help='number of times each command is run')
+    arg_parser.add_argument('-o', '--output', help='file to save the results to as JSON')
+    arg_parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    arg_parser.add_argument('--threshold', type=float, default=0.25, help='fraction a median may grow by before it fails the comparison')
+    args = arg_parser.parse_args()
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'commands': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        doc_file = os.path.join(tmp_dir, 'small.rnote')
+        with open(doc_file, 'w') as f: f.write('\n'.join(corpus.generateDocument(corpus.SCALES['small'])) + '\n')
+
+        for name, cmd in commands(doc_file, os.path.join(tmp_dir, 'small.html')).items():
+            r = results['commands'][name] = timeCommand(cmd, args.repeat)
+            print('[RNOTE] {:<14} {:.4f}s (median of {})'.format(name, r['median'], args.repeat))
+
+    if args.output: baseline.saveResults(results, args.output)
+
+    if args.baseline:
+        old_results = baseline.loadResults(args.baseline)
+        baseline.exitWithRegressions(baseline.compareMedians(medians(results), medians(old_results), args.threshold))
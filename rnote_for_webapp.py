@@ -1,22 +1,37 @@
 #!/usr/bin/env python3
 
 # RNote Processor
-from src import cliargs as cliargs
-from src import generator as gen
-from src import parser as parser
-from src import styling as sty
+from src import profiling as profiling
 from src import cfg
+from src.compiler import Compiler
 
-import argparse
-import sys
+import io
 import os
-import time
-from xhtml2pdf import pisa
-
-def run(doc: str, out_file: str):
-    # Generate the middle-man HTML, styler object, and parse. Then write to PDF
-    doc = doc.split('\r\n')
-    raw_html = gen.generateHtmlHeader()
-    style = sty.Styler()
-    raw_html = parser.parseRNoteDoc(doc, style, raw_html)
-    gen.convertHtmlToPdf(raw_html, style, out_file)
+
+cfg.IMAGE_DPI = int(os.environ.get('RNOTE_IMAGE_DPI', cfg.IMAGE_DPI))
+
+# Shared by every render of this process. Themes and templates are loaded the
+# first time a note uses them, so importing this module stays fast
+COMPILER = Compiler(preload=False)
+
+def run(doc: str, out_file, profiler: profiling.Profiler = None, **options):
+    # out_file may be a path or a writable binary buffer, and options are
+    # those of Compiler.compileTo, such as preview_pages
+    # Profile every render when RNOTE_PROFILE is set, printing the report
+    report = profiler is None and bool(os.environ.get('RNOTE_PROFILE'))
+    if report: profiler = profiling.Profiler(memory=os.environ.get('RNOTE_PROFILE') == 'memory')
+    if profiler is not None: profiler.start()
+
+    # Lay the note out straight into ReportLab if RNOTE_BACKEND asks for it.
+    # Otherwise go through the middle-man HTML
+    COMPILER.compileTo(doc, out_file, backend=os.environ.get('RNOTE_BACKEND'), profiler=profiler, **options)
+
+    if profiler is not None: profiler.stop()
+    if report: print('[RNOTE] Profile of {}:\n{}'.format(out_file, profiler.report()))
+
+
+def compileToBytes(doc: str, profiler: profiling.Profiler = None, **options) -> bytes:
+    # Compile in memory, without writing the PDF to disk
+    pdf = io.BytesIO()
+    run(doc, pdf, profiler, **options)
+    return pdf.getvalue()
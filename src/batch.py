@@ -0,0 +1,163 @@
+from src import generator as gen
+from src import parser as parser
+from src import styling as sty
+
+import glob
+import os
+import re
+import time
+
+# Commands that pull in another file: themes, templates and local images
+DEPENDENCY_PATTERN = re.compile(r'^\s*(?:\.pp\s+(theme|template|temp|templ8)|\$(li))\s+(\S+)')
+
+def findInputs(patterns: [str]) -> [str]:
+    """Expands the inputs of a batch into a list of RNote files
+
+    Parameters
+    ----------
+    patterns
+        Files, directories or glob patterns. Directories are searched for
+        .rnote files.
+
+    Returns
+    -------
+    [str]
+        Paths to the input files, without duplicates
+    """
+    inputs = []
+    for p in patterns:
+        if os.path.isdir(p): inputs += sorted(glob.glob(os.path.join(p, '*.rnote')))
+        elif glob.has_magic(p): inputs += sorted(glob.glob(p))
+        else: inputs.append(p)
+    return list(dict.fromkeys(inputs))
+
+
+def outputFor(in_file: str, out_dir: str = None) -> str:
+    """ Returns the PDF path of an input, next to it unless out_dir is given """
+    out_file = os.path.splitext(in_file)[0] + '.pdf'
+    if out_dir: out_file = os.path.join(out_dir, os.path.basename(out_file))
+    return out_file
+
+
+def dependencies(in_file: str) -> [str]:
+    """Lists the files that a document's output depends on: the document itself,
+    along with the themes, templates and local images it uses
+
+    Parameters
+    ----------
+    in_file
+        Path to the RNote file
+
+    Returns
+    -------
+    [str]
+        Paths to the files, including any that do not exist
+    """
+    deps, to_scan = [in_file, sty.themePath('simple')], [in_file]
+
+    while to_scan:
+        try: f = open(to_scan.pop())
+        except OSError: continue
+        with f:
+            for l in f:
+                m = DEPENDENCY_PATTERN.match(l)
+                if m is None: continue
+                if m.group(2) == 'li': path = m.group(3)
+                elif m.group(1) == 'theme': path = sty.themePath(m.group(3))
+                else: path = 'tmplt/' + m.group(3) + '.rntp'
+
+                if path not in deps:
+                    deps.append(path)
+                    if path.endswith('.rntp'): to_scan.append(path)
+    return deps
+
+
+def isUpToDate(in_file: str, out_file: str) -> bool:
+    """ Checks if an output is newer than its input and everything it uses """
+    try: out_mtime = os.stat(out_file).st_mtime_ns
+    except OSError: return False
+
+    for d in dependencies(in_file):
+        try:
+            if os.stat(d).st_mtime_ns > out_mtime: return False
+        except OSError: pass
+    return True
+
+
+def compileFile(in_file: str, out_file: str) -> tuple:
+    """Compiles a single RNote file into a PDF
+
+    Parameters
+    ----------
+    in_file
+        Path to the RNote file
+
+    out_file
+        Path to the new PDF document
+
+    Returns
+    -------
+    tuple
+        The input, the output, the seconds it took and an error message, which
+        is None if the file compiled successfully
+    """
+    start_time = time.time()
+    try:
+        style = sty.Styler()
+        raw_html = gen.generateHtmlHeader(style)
+        with open(in_file) as f, gen.spooledFile() as html_file:
+            parser.streamRNoteDoc(f, style, raw_html, html_file)
+            html_file.seek(0)
+            status = gen.convertHtmlToPdf(html_file, style, out_file)
+        error = 'PDF conversion failed' if status.err else None
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    return in_file, out_file, time.time() - start_time, error
+
+
+def runBatch(patterns: [str], out_dir: str = None, jobs: int = None, force: bool = False) -> int:
+    """Compiles many RNote files across worker processes and prints a summary
+
+    Parameters
+    ----------
+    patterns
+        Files, directories or glob patterns to compile
+
+    out_dir
+        Folder to write the PDFs to, defaults to next to each input
+
+    jobs
+        Number of worker processes, defaults to the number of CPUs
+
+    force
+        Compile files even if their output is up to date
+
+    Returns
+    -------
+    int
+        The number of files that failed to compile
+    """
+    start_time = time.time()
+    if out_dir: os.makedirs(out_dir, exist_ok=True)
+
+    todo, skipped = [], 0
+    for in_file in findInputs(patterns):
+        out_file = outputFor(in_file, out_dir)
+        if not force and isUpToDate(in_file, out_file): skipped += 1
+        else: todo.append((in_file, out_file))
+
+    print('[RNOTE] Compiling {} files, {} up to date'.format(len(todo), skipped))
+    if jobs is not None and jobs <= 1: results = [compileFile(*t) for t in todo]
+    elif todo:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(compileFile, *zip(*todo)))
+    else: results = []
+
+    failures = [r for r in results if r[3] is not None]
+    for in_file, out_file, seconds, error in results:
+        if error is None: print('[RNOTE] {} -> {} ({:.4f} seconds)'.format(in_file, out_file, seconds))
+        else: print('[ERR!] {} failed after {:.4f} seconds: {}'.format(in_file, seconds, error))
+
+    print('[RNOTE] {} compiled, {} failed, {} skipped in {:.4f} seconds'.format(len(results) - len(failures), len(failures), skipped, time.time() - start_time))
+    return len(failures)
@@ -1,3 +1,29 @@
-VERBOSE = False
+import contextlib
+
 DEBUG = False
-LINE_NO = 0
+
+# Resolution that images are scaled down to, in dots per inch of the page
+IMAGE_DPI = 150
+
+# Returned by Context.phase when the compile is not being profiled
+NO_PHASE = contextlib.nullcontext()
+
+class Context:
+    """State of a single compile. Each compile gets its own context, so compiles
+    running in different threads never share line numbers or profilers. The
+    settings default to the process-wide flags above.
+    """
+    def __init__(self, debug: bool = None, profiler = None, image_dpi: int = None, prepare_images: bool = True, preview: bool = False):
+        self.debug = DEBUG if debug is None else debug
+        self.profiler = profiler
+        self.image_dpi = IMAGE_DPI if image_dpi is None else image_dpi
+        self.prepare_images = prepare_images
+        self.preview = preview # Draft previews draw web images as placeholders instead of downloading them
+        self.line_no = 0
+        self.images = {} # Images being prepared for this compile, as {src: (name, future)}
+
+
+    def phase(self, name: str):
+        """ Times the with block as a phase of the compile if it is being profiled """
+        if self.profiler is None: return NO_PHASE
+        return self.profiler.phase(name)
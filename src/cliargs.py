@@ -8,8 +8,23 @@ def addArgs(p: argparse.ArgumentParser):
     p: argparse.ArguementParser 
         Object that parses command line arguements
     """
-    p.add_argument("-i", "--input", help="name of the input file")
+    p.add_argument("-i", "--input", help="name of the input file, or - to read it from stdin")
     p.add_argument("-o", "--output", help="name of the output file, default to the name of the input file with a .pdf extension")
+    p.add_argument("--html", help="writes the middle-man HTML instead of a PDF, which is much faster", action='store_true')
+    p.add_argument("--backend", choices=['pisa', 'reportlab'], default='pisa', help="renders the PDF from the middle-man HTML with xhtml2pdf (pisa), or straight from the parsed note with ReportLab, which is faster")
+    p.add_argument("--parallel", help="renders sections of a long document in parallel and merges them, starting each section on a new page", action='store_true')
+    p.add_argument("--section-blocks", type=int, default=100, metavar='N', help="blocks in a --parallel section before it ends at the next ! header, defaults to 100")
+    p.add_argument("--preview", type=float, nargs='?', const=2, metavar='PAGES', help="quickly compiles a draft of only about the first PAGES pages, defaults to 2, drawing web images as placeholders")
+    p.add_argument("--preview-blocks", type=int, metavar='N', help="like --preview, but stops after the first N blocks")
     p.add_argument("-d", "--debug", help="turns on debugging features", action='store_true')
     p.add_argument("-v", "--verbose", help="displays verbose information about what the parser is doing", action='store_true')
+    p.add_argument("-w", "--watch", help="keeps running and recompiles the input whenever it or a file it uses changes", action='store_true')
     p.add_argument("--about", help="displays information about RNote", action='store_true')
+    p.add_argument("-b", "--batch", nargs='+', metavar='INPUT', help="compiles many files, directories or glob patterns at once")
+    p.add_argument("-j", "--jobs", type=int, help="number of processes used by --batch and --parallel, defaults to the number of CPUs")
+    p.add_argument("--outdir", help="folder that --batch writes PDFs to, defaults to next to each input")
+    p.add_argument("--force", help="makes --batch compile files even if their PDF is up to date", action='store_true')
+    p.add_argument("--image-dpi", type=int, help="resolution that images larger than the page are scaled down to, defaults to 150")
+    p.add_argument("--profile", help="prints how long each phase of the compile took", action='store_true')
+    p.add_argument("--profile-out", metavar='FILE', help="also runs cProfile and saves its stats to FILE, implies --profile")
+    p.add_argument("--profile-memory", help="also measures peak memory use, implies --profile", action='store_true')
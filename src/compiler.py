@@ -0,0 +1,186 @@
+from src import flowables as flowables
+from src import generator as gen
+from src import pagedimensions as pd
+from src import parser as parser
+from src import preview as preview
+from src import styling as sty
+from src import cfg
+
+import glob
+import io
+import os
+
+# Styler settings that can be given to each compile, before the note's own .pp commands
+SETTINGS = ('theme', 'pagesize', 'margin', 'orientation')
+
+def checkSetting(name: str, value) -> str:
+    """Checks a setting given to a compiler or compile, normalizing it the way
+    its .pp command does, such as 'A4' to 'a4' or 'land' to 'landscape'
+
+    Parameters
+    ----------
+    name
+        The setting, one of SETTINGS
+
+    value
+        Its value
+
+    Returns
+    -------
+    str
+        The value to set on the styler
+
+    Raises
+    ------
+    TypeError
+        If the setting is not one of SETTINGS
+
+    ValueError
+        If the value is not a known theme, page size, margin or orientation
+    """
+    if name not in SETTINGS: raise TypeError('Unknown setting: {}'.format(name))
+    value = str(value)
+    if name == 'theme': valid = os.path.exists(sty.themePath(value))
+    elif name == 'pagesize':
+        value = value.lower()
+        valid = value in pd.PAGE_SIZES
+    elif name == 'margin': valid = value in pd.MARGINS
+    else:
+        valid = value.lower() in parser.ORIENTATIONS
+        value = parser.ORIENTATIONS.get(value.lower(), value)
+    if not valid: raise ValueError('Unknown {}: {}'.format(name, value))
+    return value
+
+
+class Compiler:
+    """Compiles many notes in one process. Themes, templates, page geometry and
+    the rendering libraries are loaded once when the compiler is created, so
+    each compile only pays for parsing and rendering its own note. Every compile
+    gets its own context, so one compiler can be shared between threads.
+    Warnings about a note, such as unknown commands or images that could not be
+    fetched, are still printed as they are by the command line compiler.
+
+    Settings given to the compiler or to compile are applied before the note is
+    parsed, so .pp commands in the note still override them.
+    """
+    def __init__(self, backend: str = 'pisa', image_dpi: int = None, prepare_images: bool = True, preload: bool = True, **settings):
+        unknown = set(settings) - set(SETTINGS)
+        if unknown: raise TypeError('Unknown settings: {}'.format(', '.join(sorted(unknown))))
+        self.backend = backend
+        self.image_dpi = image_dpi
+        self.prepare_images = prepare_images
+        self.settings = {name: checkSetting(name, value) for name, value in settings.items()}
+        if preload: self.preload()
+
+
+    def preload(self):
+        """ Loads every theme, template and page geometry, and imports the renderer of the backend """
+        for theme in sorted(os.listdir('themes')):
+            if os.path.exists(sty.themePath(theme)): sty.loadTheme(theme)
+        for template in sorted(glob.glob('tmplt/*.rntp')):
+            parser.loadTemplate(os.path.splitext(os.path.basename(template))[0])
+        for pagesize in pd.PAGE_SIZES:
+            for margin in pd.MARGINS:
+                for orientation in ('portrait', 'landscape'): sty.pageGeometry(pagesize, orientation, margin)
+
+        if self.backend == 'reportlab': import reportlab.platypus
+        else: from xhtml2pdf import pisa
+
+
+    def styler(self, ctx: cfg.Context, settings: dict) -> sty.Styler:
+        """ Creates the styler of a compile, with the compiler's settings and then the compile's applied """
+        settings = {name: checkSetting(name, value) for name, value in settings.items()}
+        style = sty.Styler(ctx)
+        for name, value in {**self.settings, **settings}.items(): setattr(style, name, value)
+        return style
+
+
+    def compileTo(self, text: str, out_file, backend: str = None, profiler = None, image_dpi: int = None,
+            preview_pages: float = None, preview_blocks: int = None, **settings) -> bool:
+        """Compiles a note into a PDF
+
+        Parameters
+        ----------
+        text
+            The RNote source of the note
+
+        out_file
+            Path to the new PDF document, or a writable binary file-like object
+
+        backend
+            Either 'pisa' or 'reportlab', defaults to the compiler's backend
+
+        profiler
+            Profiler that the phases of the compile are timed with
+
+        image_dpi
+            Resolution images are scaled down to, defaults to the compiler's
+
+        preview_pages
+            Compiles a draft preview of only about this many pages
+
+        preview_blocks
+            Compiles a draft preview of only this many blocks
+
+        settings
+            Styler settings for this compile, one of SETTINGS
+
+        Returns
+        -------
+        bool
+            True if conversion was successful, False otherwise
+
+        Raises
+        ------
+        ValueError
+            If a setting is not a known theme, page size, margin or orientation
+        """
+        backend = backend or self.backend
+        if image_dpi is None: image_dpi = self.image_dpi
+        ctx = cfg.Context(profiler=profiler, image_dpi=image_dpi, prepare_images=self.prepare_images)
+        style = self.styler(ctx, settings)
+        doc = io.StringIO(text, newline=None)
+
+        # Previews are small, so they are built whole rather than streamed
+        if preview_pages is not None or preview_blocks is not None:
+            if backend == 'reportlab':
+                document = preview.buildPreview(doc, style, flowables.FlowableDocument(ctx), preview_pages, preview_blocks)
+                return flowables.convertToPdf(document, style, out_file)
+            raw_html = preview.buildPreview(doc, style, gen.generateHtmlHeader(style), preview_pages, preview_blocks)
+            return not gen.convertHtmlToPdf(raw_html.getvalue(), style, out_file).err
+
+        if backend == 'reportlab':
+            document = parser.buildRNoteDoc(doc, style, flowables.FlowableDocument(ctx))
+            return flowables.convertToPdf(document, style, out_file)
+
+        raw_html = gen.generateHtmlHeader(style)
+        with gen.spooledFile() as html_file:
+            parser.streamRNoteDoc(doc, style, raw_html, html_file)
+            html_file.seek(0)
+            return not gen.convertHtmlToPdf(html_file, style, out_file).err
+
+
+    def compile(self, text: str, **options) -> bytes:
+        """Compiles a note in memory
+
+        Parameters
+        ----------
+        text
+            The RNote source of the note
+
+        options
+            Options of compileTo, such as backend, image_dpi or theme
+
+        Returns
+        -------
+        bytes
+            The PDF
+
+        Raises
+        ------
+        RuntimeError
+            If the PDF could not be rendered
+        """
+        pdf = io.BytesIO()
+        if not self.compileTo(text, pdf, **options): raise RuntimeError('PDF conversion failed')
+        return pdf.getvalue()
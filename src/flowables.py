@@ -0,0 +1,289 @@
+from src import styling as sty
+from src import cfg
+from src import imagecache as imagecache
+
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# Built-in PDF fonts used for each generic CSS font family
+FONT_FAMILIES = {'serif': 'Times-Roman', 'sans-serif': 'Helvetica', 'monospace': 'Courier'}
+
+# Common font names and the generic family they are drawn with
+FONT_NAMES = {
+    'times': 'serif', 'times new roman': 'serif', 'georgia': 'serif',
+    'arial': 'sans-serif', 'helvetica': 'sans-serif', 'verdana': 'sans-serif',
+    'courier': 'monospace', 'courier new': 'monospace'
+}
+
+# Sizes xhtml2pdf uses for a page with no other styling, in points
+BASE_FONT_SIZE = 7.5 # html { font-size: 10px }
+LINE_HEIGHT = 1.5
+
+# ZapfDingbats characters drawn for each level of bullet, like disc, circle and square
+BULLET_CHARS = ('l', 'm', 'n')
+
+# Inline tags made by the parser's formatter that ReportLab spells differently
+INLINE_TAGS = {'<del>': '<strike>', '</del>': '</strike>'}
+
+class FlowableDocument:
+    """Model of a document as the blocks ReportLab will lay out, built from the
+    same calls the parser makes on generator.HtmlDocument. Blocks are kept as
+    plain (kind, ...) tuples and only turned into flowables by convertToPdf(),
+    once the page size and theme from the preprocessor commands are final.
+    """
+    def __init__(self, ctx: cfg.Context = None):
+        self.ctx = ctx if ctx is not None else cfg.Context()
+        self.title = ''
+        self.blocks = []
+
+
+    def addElement(self, element: str, the_text: str):
+        """ Adds a simple element, such as a header or paragraph """
+        self.blocks.append((element, the_text))
+
+
+    def addImage(self, src: str):
+        """ Adds an image """
+        self.blocks.append(('img', src))
+
+
+    def addPlaceholder(self, src: str, width: float, height: float):
+        """ Adds a box of width by height cm in place of an image that was not loaded """
+        self.blocks.append(('placeholder', src, width, height))
+
+
+    def addBullets(self, bullets):
+        """ Adds a bullet list from any iterable of (indent level, text) """
+        self.blocks.append(('ul', list(bullets)))
+
+
+    def addTable(self, head: [str], rows, chunk_rows: int = None):
+        """ Adds a table from its header cells and any iterable of rows of cells, split after every chunk_rows rows """
+        self.blocks.append(('table', head, list(rows), chunk_rows))
+
+
+def themeRules(theme: str) -> dict:
+    """Reads the declarations of a theme's stylesheet
+
+    Parameters
+    ----------
+    theme
+        The stylesheet of the theme
+
+    Returns
+    -------
+    dict
+        {selector: {property: value}}, with later rules overriding earlier ones
+    """
+    import tinycss
+
+    rules = {}
+    for rule in tinycss.make_parser('page3').parse_stylesheet(theme).rules:
+        if not hasattr(rule, 'selector'): continue
+        declarations = {d.name: d.value.as_css() for d in rule.declarations}
+        for selector in rule.selector.as_css().split(','):
+            rules.setdefault(' '.join(selector.split()), {}).update(declarations)
+    return rules
+
+
+def length(value: str, font_size: float, default: float = 0.0) -> float:
+    """ Converts a CSS length in em, px, pt, cm, mm or in into points """
+    m = re.match(r'^\s*(-?[\d.]+)\s*(em|px|pt|cm|mm|in)?', value or '')
+    if m is None: return default
+    number, unit = float(m.group(1)), m.group(2)
+    return number * {'em': font_size, 'px': 0.75, 'pt': 1.0, 'cm': 72 / 2.54, 'mm': 72 / 25.4, 'in': 72.0, None: 1.0}[unit]
+
+
+def color(value: str, default):
+    """ Converts a CSS color into a ReportLab color """
+    from reportlab.lib import colors
+
+    if not value: return default
+    value = value.strip()
+    if re.match(r'^#[0-9a-fA-F]{3}$', value): value = '#' + ''.join(c * 2 for c in value[1:])
+    try: return colors.toColor(value)
+    except ValueError: return default
+
+
+def fontName(family: str) -> str:
+    """ Picks the built-in font for a CSS font-family list """
+    for name in (family or '').split(','):
+        name = name.strip().strip('"\'').lower()
+        generic = FONT_NAMES.get(name, name)
+        if generic in FONT_FAMILIES: return FONT_FAMILIES[generic]
+    return FONT_FAMILIES['sans-serif']
+
+
+def paragraphStyles(theme: str) -> dict:
+    """Builds the ReportLab paragraph styles of each element from a theme
+
+    Parameters
+    ----------
+    theme
+        The stylesheet of the theme
+
+    Returns
+    -------
+    dict
+        {element: ParagraphStyle} for p, h1, h2, h3, li and th, along with the
+        'indent' of each level of bullets and the 'grid' width of table
+        borders in points, which is 0 if the theme has none
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle
+
+    rules = themeRules(theme)
+    body = dict(rules.get('html', {}), **rules.get('body', {}))
+    base = ParagraphStyle('p', fontName=fontName(body.get('font-family')), fontSize=BASE_FONT_SIZE,
+        leading=BASE_FONT_SIZE * LINE_HEIGHT, textColor=color(body.get('color'), colors.black))
+
+    styles = {}
+    for element in ('p', 'h1', 'h2', 'h3'):
+        r = rules.get(element, {})
+        size = length(r.get('font-size'), BASE_FONT_SIZE, BASE_FONT_SIZE)
+        styles[element] = ParagraphStyle(element, parent=base, fontSize=size, leading=size * LINE_HEIGHT,
+            spaceBefore=length(r.get('margin-top'), size), spaceAfter=length(r.get('margin-bottom'), size),
+            textColor=color(r.get('color'), base.textColor))
+        if r.get('font-weight') == 'bold': styles[element].fontName = boldFont(base.fontName)
+
+    styles['li'] = ParagraphStyle('li', parent=base, bulletFontName='ZapfDingbats', bulletFontSize=BASE_FONT_SIZE * 0.6)
+    styles['th'] = ParagraphStyle('th', parent=base, fontName=boldFont(base.fontName))
+    styles['indent'] = length(rules.get('ul', {}).get('margin-left'), BASE_FONT_SIZE, 1.5 * BASE_FONT_SIZE)
+    styles['grid'] = length(rules.get('td', {}).get('border-top-width'), BASE_FONT_SIZE)
+    return styles
+
+
+def boldFont(font: str) -> str:
+    """ Returns the bold version of a built-in font """
+    from reportlab.lib.fonts import tt2ps
+    return tt2ps(font, 1, 0)
+
+
+def paragraph(text: str, style):
+    """Makes a paragraph of formatted text. Text that ReportLab cannot parse,
+    such as unknown HTML tags, is drawn as it is written.
+    """
+    from reportlab.platypus import Paragraph
+    from xml.sax.saxutils import escape
+
+    for tag, rl_tag in INLINE_TAGS.items(): text = text.replace(tag, rl_tag)
+    try: return Paragraph(text, style)
+    except ValueError:
+        log.info('Could not parse inline markup of %r, drawing it as text', text)
+        return Paragraph(escape(text), style)
+
+
+def imageFlowable(filename: str, max_width: float, max_height: float):
+    """ Makes an image at its size in CSS pixels, shrunk to fit in the frame """
+    from reportlab.lib.utils import ImageReader
+    from reportlab.platypus import Image
+
+    width, height = (d * 0.75 for d in ImageReader(filename).getSize())
+    scale = min(1.0, max_width / width, max_height / height)
+    return Image(filename, width * scale, height * scale)
+
+
+def buildFlowables(document: FlowableDocument, style: sty.Styler, images: dict, missing: set) -> list:
+    """Turns the blocks of a document into ReportLab flowables
+
+    Parameters
+    ----------
+    document
+        The parsed document
+
+    style
+        Styler object with the final page size and theme of the document
+
+    images
+        The file to embed for each prepared image src, from imagecache.waitFor
+
+    missing
+        Image srcs that could not be downloaded, which have already been warned about
+
+    Returns
+    -------
+    list
+        The flowables of the document, in order
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.units import cm
+    from reportlab.platypus import HRFlowable, Spacer, Table, TableStyle
+    from xml.sax.saxutils import escape
+
+    styles = paragraphStyles(style.theme)
+    cell_style = styles['p'].clone('td', spaceBefore=0, spaceAfter=0)
+    table_style = TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP'), ('TOPPADDING', (0, 0), (-1, -1), 2)])
+    if styles['grid']: table_style.add('GRID', (0, 0), (-1, -1), styles['grid'], colors.black)
+    frame_width, frame_height = style.width * cm, style.height * cm
+    flowables = []
+    for kind, *args in document.blocks:
+        if kind in ('p', 'h1', 'h2', 'h3'): flowables.append(paragraph(args[0], styles[kind]))
+        elif kind == 'hr': flowables.append(HRFlowable(width='100%', thickness=0.75, color=styles['p'].textColor, spaceBefore=4, spaceAfter=4))
+        elif kind == 'br': flowables.append(Spacer(0, styles['p'].leading))
+        elif kind == 'img':
+            src = args[0]
+            if src in missing: continue
+            try: flowables.append(imageFlowable(images.get(src, src), frame_width, frame_height))
+            except Exception as e: print('[WARN] Could not load image {}, leaving it out: {}'.format(src, e))
+        elif kind == 'placeholder':
+            src, width, height = args
+            box = Table([[paragraph('Image: ' + escape(src), styles['p'].clone('placeholder', alignment=1, textColor=colors.grey))]],
+                colWidths=[width * cm], rowHeights=[height * cm], style=[('BOX', (0, 0), (-1, -1), 0.75, colors.grey, None, (2, 2)), ('VALIGN', (0, 0), (-1, -1), 'MIDDLE')])
+            flowables.append(box)
+        elif kind == 'ul':
+            for level, text in args[0]:
+                indent = styles['indent'] * level
+                flowables.append(paragraph(text, styles['li'].clone('li', leftIndent=indent, bulletIndent=indent - styles['indent'] / 2,
+                    bulletText=BULLET_CHARS[min(level, len(BULLET_CHARS)) - 1])))
+        elif kind == 'table':
+            # Long tables are split into chunks that each start with the header
+            head, rows, chunk_rows = args
+            columns = max([len(head)] + [len(r) for r in rows])
+            step = chunk_rows or len(rows) or 1
+            for start in range(0, len(rows) or 1, step):
+                data = [[paragraph(c, styles['th']) for c in head] + [''] * (columns - len(head))]
+                data += [[paragraph(c, cell_style) for c in r] + [''] * (columns - len(r)) for r in rows[start:start + step]]
+                flowables.append(Table(data, colWidths=[frame_width / columns] * columns, repeatRows=1, style=table_style))
+    return flowables
+
+
+def convertToPdf(document: FlowableDocument, style: sty.Styler, out_file: str) -> bool:
+    """Lays a parsed document out straight into a PDF with ReportLab, without
+    going through the HTML middle-man and xhtml2pdf
+
+    Parameters
+    ----------
+    document
+        The parsed document
+
+    style
+        Styler object with the page size, frame and theme of the document
+
+    out_file
+        Path to the new PDF document, or a writable binary file-like object
+
+    Returns
+    -------
+    bool
+        True if conversion was successful, False otherwise
+    """
+    from reportlab.lib.units import cm
+    from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate
+
+    ctx = style.ctx
+    with ctx.phase('images'):
+        # Images that could not be scaled are still embedded, only failed downloads are left out
+        missing = set(ctx.images)
+        images = imagecache.waitFor(ctx.images)
+        missing -= set(images)
+
+    with ctx.phase('render'):
+        g = style.geometry
+        frame = Frame(g.left * cm, (g.page_height - g.top - g.height) * cm, g.width * cm, g.height * cm,
+            leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0)
+        pdf = BaseDocTemplate(out_file, pagesize=(g.page_width * cm, g.page_height * cm), pageTemplates=[PageTemplate('page', [frame])],
+            title=document.title.strip(), author='RNote Compiler')
+        pdf.build(buildFlowables(document, style, images, missing))
+    return True
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+
+import os
+import threading
+import time
+
+class FolderCache:
+    """LRU index of the files stored in a folder, each under a key with one of a
+    few extensions. The least recently used files are deleted once there are
+    more than max_entries of them or they take up more than max_bytes, and once
+    they have not been used for max_idle seconds if that is given.
+
+    The folder, not the index, is the record of what is cached. The time each
+    file was last used is kept as its access time, and the index is rebuilt
+    from the folder when the cache is created, on every sweep and whenever it
+    goes over its limits. So caches in several processes can share a folder,
+    such as those of renders that each run in their own process, and its
+    limits still hold.
+
+    Files are written under a random suffix, such as <key>.<random>.pdf or
+    <key>.png.<random>, and only moved into place once they are complete. Any
+    left behind, such as by a process that was killed, are deleted by sweep.
+    """
+    # Name of what is cached, used in messages
+    kind = 'file'
+
+    def __init__(self, directory: str, extensions: tuple, max_entries: int, max_bytes: int, max_idle: float = None):
+        self.directory = directory
+        self.extensions = extensions
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.entries = OrderedDict() # {key: [size in bytes, time last used]}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._sweeper = None
+        os.makedirs(directory, exist_ok=True)
+        self.adopt()
+
+
+    def scan(self) -> [tuple]:
+        """ Lists the complete files in the folder as (time last used, key, size in bytes), least recently used first """
+        found = []
+        for entry in os.scandir(self.directory):
+            key, ext = os.path.splitext(entry.name)
+            if '.' in key or ext not in self.extensions: continue # Unfinished, or not part of the cache
+            try: st = entry.stat()
+            except OSError: continue
+            found.append((max(st.st_atime, st.st_mtime), key, st.st_size))
+        return sorted(found)
+
+
+    def adopt(self):
+        """ Rebuilds the index from the files in the folder, evicting any over the limits """
+        found = self.scan()
+        with self._lock:
+            self._index(found)
+            self._evict(time.time(), rescan=False)
+
+
+    def _index(self, found: [tuple]):
+        """ Replaces the index with files listed by scan. Must hold the lock """
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        for last_used, key, size in found:
+            if key in self.entries: size += self.entries.pop(key)[0]
+            self.entries[key] = [size, last_used]
+            self.total_bytes += size
+
+
+    def _entry(self, key: str, filename: str) -> list:
+        """ Returns the entry of a file, tracking it first if another process saved it, or None if it is not there. Must hold the lock """
+        if not os.path.exists(filename): return None
+        entry = self.entries.get(key)
+        if entry is None:
+            try: st = os.stat(filename)
+            except OSError: return None
+            entry = self.entries[key] = [st.st_size, max(st.st_atime, st.st_mtime)]
+            self.total_bytes += st.st_size
+            self._evict(time.time())
+        return entry
+
+
+    def _use(self, key: str, filename: str):
+        """ Marks a file as just used, in the index and in the folder as its access time. Must hold the lock """
+        self.entries.move_to_end(key)
+        self.entries[key][1] = time.time()
+        try: os.utime(filename, ns=(time.time_ns(), os.stat(filename).st_mtime_ns))
+        except OSError: pass
+
+
+    def _add(self, key: str, size: int):
+        """ Records a newly stored file, evicting old files to stay within the limits. Must hold the lock """
+        if key in self.entries: self.total_bytes -= self.entries.pop(key)[0]
+        self.entries[key] = [size, time.time()]
+        self.total_bytes += size
+        self._evict(time.time())
+
+
+    def _full(self) -> bool:
+        """ Checks if the index has more files or bytes than the limits. Must hold the lock """
+        return len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes)
+
+
+    def _evict(self, now: float, rescan: bool = True):
+        """Deletes the least recently used files until the cache is within its
+        limits. Other processes may have added or used files since the index was
+        built, so it is rebuilt from the folder first if it is over the limits.
+        Must hold the lock
+        """
+        if rescan and self._full(): self._index(self.scan())
+        while self.entries:
+            old_key, (old_size, last_used) = next(iter(self.entries.items()))
+            idle = self.max_idle is not None and now - last_used > self.max_idle
+            if not self._full() and not idle: break
+
+            del self.entries[old_key]
+            self.total_bytes -= old_size
+            self.evictions += 1
+            for ext in self.extensions:
+                try: os.remove(os.path.join(self.directory, old_key + ext))
+                except OSError: pass
+
+
+    def sweep(self, grace: float = 10 * 60):
+        """Deletes files that were never finished, such as those of renders that
+        were killed, then rebuilds the index from the folder and evicts files
+        until the cache is within its limits
+
+        Parameters
+        ----------
+        grace
+            Seconds that an unfinished file is left alone for, so files that
+            are still being written are not deleted
+        """
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            parts = entry.name.split('.')
+            if len(parts) != 3 or not parts[0] or not any('.' + p in self.extensions for p in parts[1:]): continue
+            try:
+                if now - entry.stat().st_mtime > grace: os.remove(entry.path)
+            except OSError: pass
+        self.adopt()
+
+
+    def startSweeper(self, interval: float = 60):
+        """ Sweeps the cache every interval seconds in a background thread """
+        if self._sweeper is not None: return
+
+        def sweepForever():
+            while True:
+                time.sleep(interval)
+                try: self.sweep()
+                except Exception as e: print('[ERR!] Could not sweep the {} cache: {}'.format(self.kind, e))
+
+        self._sweeper = threading.Thread(target=sweepForever, name='{}-cache-sweeper'.format(self.kind.lower()), daemon=True)
+        self._sweeper.start()
+
+
+    def stats(self) -> dict:
+        """ Returns the counters of the cache """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes
+            }
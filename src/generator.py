@@ -1,48 +1,222 @@
 from src import styling as sty
-from src import cfg
+from src import imagecache as imagecache
 
-import re
+import io
+import logging
+import os
+import shutil
+import tempfile
 
-from yattag import Doc, indent
-from xhtml2pdf import pisa
-from datetime import datetime
+from yattag import Doc
 
-def generateHtmlHeader() -> str:
-    """Generates the skeleton HTML file
+log = logging.getLogger(__name__)
+
+# Height of a table row of a single line of text in points, as xhtml2pdf lays it
+# out with the themes' padding and borders
+TABLE_ROW_HEIGHT = 18
+
+# Pages of rows that long tables are split after. A chunk rarely starts at the
+# top of a page, so its header shows up mid-page as well as at the top
+TABLE_CHUNK_PAGES = 4
+
+# Points in a centimetre
+POINTS_PER_CM = 72 / 2.54
+
+# Bytes of HTML kept in memory before it is spooled to disk
+SPOOL_BYTES = 8 * 1024 * 1024
+
+def spooledFile(max_size: int = SPOOL_BYTES):
+    """ Returns a temporary text file for HTML, which stays in memory until it grows past max_size bytes """
+    return tempfile.SpooledTemporaryFile(max_size=max_size, mode='w+', encoding='utf-8')
+
+
+class HtmlDocument:
+    """In-memory model of the middle-man HTML document. Blocks are appended to
+    the body as fragments and the whole document is only serialized once, by
+    getvalue() or writeTo(), after parsing has finished. The @page styling is
+    taken from the styler then, once preprocessor commands are done changing it.
+    """
+    def __init__(self, style: sty.Styler = None):
+        self.style = style if style is not None else sty.Styler()
+        self.ctx = self.style.ctx
+        self.title = ''
+        self.body = []
+        self._spool = None
+
+
+    def append(self, fragment: str):
+        """ Appends an HTML fragment to the end of the document body """
+        if self._spool is None: self.body.append(fragment)
+        else: self._spool.write(fragment)
+
+
+    def addElement(self, element: str, the_text: str):
+        """ Appends a simple element, such as a header or paragraph """
+        doc, tag, text, line = Doc().ttl()
+        with tag(element): doc.asis(the_text)
+        self.append(doc.getvalue())
+
+
+    def addImage(self, src: str):
+        """ Appends an image """
+        doc, tag, text, line = Doc().ttl()
+        doc.stag('img', src=src)
+        self.append(doc.getvalue())
+
+
+    def addPlaceholder(self, src: str, width: float, height: float):
+        """ Appends a dashed box of width by height cm in place of an image that was not loaded """
+        doc, tag, text, line = Doc().ttl()
+        box = 'width: {:.2f}cm; border: 1px dashed #999; color: #999;'.format(width)
+        with tag('table', style=box):
+            with tag('tr'):
+                with tag('td', style='height: {:.2f}cm; border: none; text-align: center; vertical-align: middle;'.format(height)):
+                    text('Image: ' + src)
+        self.append(doc.getvalue())
+
+
+    def addBullets(self, bullets):
+        """ Appends a bullet list from any iterable of (indent level, text) """
+        original_indent_lvl = 0
+        for current_indent_lvl, b in bullets:
+            indent = ''
+
+            # If there are more bullets, add the difference number of ul tags
+            if current_indent_lvl > original_indent_lvl:
+                log.info('Increasing indent level of list')
+                indent = '<ul>' * (current_indent_lvl - original_indent_lvl)
+                original_indent_lvl = current_indent_lvl
+
+            # If there are fewer bullets, add the difference of ending ul tags
+            elif current_indent_lvl < original_indent_lvl:
+                log.info('Decreasing indent level of list')
+                indent = '</ul>' * (original_indent_lvl - current_indent_lvl)
+                original_indent_lvl = current_indent_lvl
+
+            # Add the li tag. Lists can be very long, so this skips yattag
+            self.append(indent + '<li>' + b + '</li>')
+
+        # Add in the remaining closing ul tags
+        self.append('</ul>' * original_indent_lvl)
+
+
+    def addTable(self, head: [str], rows, chunk_rows: int = None):
+        """Appends a table from its header cells and any iterable of rows of
+        cells. The header repeats at the top of every page the table is on.
+        Tables with more than chunk_rows rows are split into several tables of
+        that many rows that each start with the header, since laying out a
+        table takes time that grows with the square of its length.
+        """
+        doc, tag, text, line = Doc().ttl()
+        doc.asis('<table repeat="1">')
+        with tag('tr'):
+            for i in head:
+                with tag('th'): doc.asis(i)
+        header = doc.getvalue()
+        self.append(header)
+
+        # Tables can be very long, so rows skip yattag
+        in_chunk = 0
+        for cells in rows:
+            if in_chunk == chunk_rows:
+                self.append('</table>' + header)
+                in_chunk = 0
+            self.append('<tr><td>' + '</td><td>'.join(cells) + '</td></tr>')
+            in_chunk += 1
+        self.append('</table>')
+
+
+    def spoolBody(self, max_size: int = SPOOL_BYTES):
+        """Writes the body to a temporary file from now on instead of keeping it
+        in memory. The file stays in memory until it grows past max_size bytes.
+        """
+        self._spool = spooledFile(max_size)
+        for fragment in self.body: self._spool.write(fragment)
+        self.body = []
+
+
+    def skeleton(self) -> (str, str):
+        """Serializes the parts of the document around the body
+
+        Returns
+        -------
+        (str, str)
+            The HTML before the body fragments and the HTML after them
+        """
+        doc, tag, text, line = Doc().ttl()
+        doc.asis('<!DOCTYPE html>')
+
+        with tag('html'):
+            with tag('head'):
+                doc.stag('meta', charset='utf-8')
+                with tag('title'): doc.asis(self.title)
+                doc.stag('meta', name='description', content='An HTML file generated by the RNote compiler.')
+                doc.stag('meta', name='author', content='RNote Compiler')
+            with tag('body'):
+                with tag('style'):
+                    doc.asis('@page {' + self.style.geometry.css + '/*EndOf@pageManualStyling*/}')
+                with tag('div', id='content'): doc.asis('\0')
+        head, tail = doc.getvalue().split('\0')
+        return head, tail
+
+
+    def getvalue(self) -> str:
+        """Serializes the document into a single HTML string
+
+        Returns
+        -------
+        str
+            A string containing the contents of the HTML file generated
+        """
+        out = io.StringIO()
+        self.writeTo(out)
+        return out.getvalue()
+
+
+    def writeTo(self, sink):
+        """Serializes the document into a file-like object, one piece at a time
+
+        Parameters
+        ----------
+        sink
+            Writable text file-like object
+        """
+        with self.ctx.phase('assemble'):
+            head, tail = self.skeleton()
+            sink.write(head)
+            if self._spool is None:
+                for fragment in self.body: sink.write(fragment)
+            else:
+                self._spool.seek(0)
+                shutil.copyfileobj(self._spool, sink)
+                self._spool.seek(0, io.SEEK_END)
+            sink.write(tail)
+
+
+def generateHtmlHeader(style: sty.Styler) -> HtmlDocument:
+    """Generates the skeleton HTML document
+
+    Parameters
+    ----------
+    style
+        Styler object that the page styling is taken from
 
     Returns
     -------
-    str
-        A string containing the contents of the HTML file generated
+    HtmlDocument
+        An empty document that takes its page styling from the styler
     """
-    doc, tag, text, line = Doc().ttl()
-    doc.asis('<!DOCTYPE html>')
-    
-    with tag('html'):
-        if cfg.VERBOSE: print('[INFO] Generating HTML header')
-        with tag('head'):
-            doc.stag('meta', charset='utf-8')
-            with tag('title'): text('')
-            doc.stag('meta', name='description', content='An HTML file generated by the RNote compiler.')
-            doc.stag('meta', name='author', content='RNote Compiler')
-        if cfg.VERBOSE: print('[INFO] Generating HTML body')
-        with tag('body'):
-            with tag('style'):
-                style = sty.Styler() # Temp obj.
-                doc.asis('@page {{size: {} {}; @frame {{top: {}cm; left: {}cm; height: {}cm; width: {}cm; -pdf-frame-border:1;}}'.format(style.pagesize, style.orientation, style.top, style.left, style.height, style.width))
-                doc.asis('/*EndOf@pageManualStyling*/}')
-                del style
-            with tag('div', id='content'): pass
-    return doc.getvalue()
-
-
-def insertElementIntoHtml(html: str, the_text: str, element: str) -> str:
+    log.info('Generating HTML header')
+    return HtmlDocument(style)
+
+
+def insertElementIntoHtml(html: HtmlDocument, the_text: str, element: str) -> HtmlDocument:
     """Inserts a simple HTML element into the document
 
     Parameters
     ----------
     html
-        The HTML file that will get the new element
+        The HTML document that will get the new element
     the_text
         Text value of the new element
     element
@@ -50,18 +224,15 @@ def insertElementIntoHtml(html: str, the_text: str, element: str) -> str:
 
     Returns
     -------
-    str
+    HtmlDocument
         The HTML document with new element inserted
     """
-    doc, tag, text, line = Doc().ttl()
-    with tag(element):
-        if cfg.VERBOSE: print('[INFO] Inserting {} element'.format(element))
-        doc.asis(the_text)
-    upper, lower = html.split('</div></body>', 1)[0], html.split('</div></body>', 1)[1]
-    return upper + doc.getvalue() + "</div></body>" + lower
+    log.info('Inserting %s element', element)
+    html.addElement(element, the_text)
+    return html
 
 
-def insertDocTitleIntoHtml(html: str, the_title: str) -> str:
+def insertDocTitleIntoHtml(html: HtmlDocument, the_title: str) -> HtmlDocument:
     """Sets the title of the document
 
     Parameters
@@ -74,15 +245,15 @@ def insertDocTitleIntoHtml(html: str, the_title: str) -> str:
 
     Returns
     -------
-    str
+    HtmlDocument
         The HTML document with the new document title
     """
-    upper, lower = html.split('</title>', 1)[0], html.split('</title>', 1)[1]
-    if cfg.VERBOSE: print('[INFO] Setting new document title')
-    return upper + the_title + '</title>' + lower
+    log.info('Setting new document title')
+    html.title += the_title
+    return html
 
 
-def insertImageIntoHtml(html: str, img: str) -> str:
+def insertImageIntoHtml(html: HtmlDocument, img: str) -> HtmlDocument:
     """Inserts an image into the document. Despite being labeled differently,
     $wi and $li use the same function.
 
@@ -96,14 +267,12 @@ def insertImageIntoHtml(html: str, img: str) -> str:
 
     Returns
     -------
-    str
+    HtmlDocument
         The HTML document with the new image
     """
-    doc, tag, text, line = Doc().ttl()
-    doc.stag('img', src=img)
-    upper, lower = html.split('</div></body>', 1)[0], html.split('</div></body>', 1)[1]
-    if cfg.VERBOSE: print('[INFO] Adding image')
-    return upper + doc.getvalue() + '</div></body>' + lower
+    log.info('Adding image')
+    html.addImage(img)
+    return html
 
 
 def convertHtmlToPdf(raw_html: str, style: sty.Styler, out_file: str) -> bool:
@@ -112,104 +281,87 @@ def convertHtmlToPdf(raw_html: str, style: sty.Styler, out_file: str) -> bool:
     Parameters
     ----------
     raw_html
-        The HTML of the document to be converted
+        The HTML of the document to be converted, as a string or a readable
+        file-like object
     
     style
         Styler object that contains CSS rules for the HTML document
 
     out_file
-        Path to the new PDF document
+        Path to the new PDF document, or a writable binary file-like object,
+        such as a BytesIO, that the PDF is written straight into
 
     Returns
     -------
     bool
         True if conversion was successful, False otherwise
     """
-    result_file = open(out_file, "w+b")
-    status = pisa.CreatePDF(raw_html, dest=result_file, default_css=style.theme, debug=1)
-    result_file.close()
+    with style.ctx.phase('images'): images = imagecache.waitFor(style.ctx.images)
+    if not isinstance(out_file, (str, os.PathLike)):
+        with style.ctx.phase('render'): return renderHtml(raw_html, style.theme, images, out_file)
+
+    with style.ctx.phase('render'):
+        pdf = io.BytesIO()
+        status = renderHtml(raw_html, style.theme, images, pdf)
+    with style.ctx.phase('write'):
+        with open(out_file, "wb") as result_file: result_file.write(pdf.getbuffer())
     return status
 
 
-def generateBulletPoints(html: str, bullets: list) -> str:
-    """Generates bullet point list for a document
+def renderHtml(raw_html: str, theme: str, images: dict, dest):
+    """Renders HTML into a PDF with xhtml2pdf
 
     Parameters
     ----------
-    html
-        The HTML document to get the new bullet list
-    
-    bullets
-        List of lines that contain the bullets
-
-    Returns
-    -------
-    str
-        The HTML document with new bullet list
-
-    """
-    doc, tag, text, line = Doc().ttl()
-    first_line = bullets[0]
-
-    # Count the indent level and set it for the first line
-    original_indent_lvl = first_line.split()[0].count('-')
-    doc.asis('<ul>' * original_indent_lvl)
+    raw_html
+        The HTML to render, as a string or a readable file-like object
 
-    for b in bullets:
-        # Count the level of indent that we are currently on and compare
-        current_indent_lvl = b.split()[0].count('-')
+    theme
+        Stylesheet of the document's theme
 
-        # If there are more bullets, add the difference number of ul tags
-        if current_indent_lvl > original_indent_lvl:
-            if cfg.VERBOSE: print('[INFO] Increasing indent level of list')
-            doc.asis('<ul>' * (current_indent_lvl - original_indent_lvl))
-            original_indent_lvl = current_indent_lvl
+    images
+        The file to embed for each image src that was prepared, from
+        imagecache.waitFor
 
-        # If there are fewer bullets, add the difference of ending ul tags
-        elif current_indent_lvl < original_indent_lvl:
-            if cfg.VERBOSE: print('[INFO] Decreasing indent level of list')
-            doc.asis('</ul>' * (original_indent_lvl - current_indent_lvl))
-            original_indent_lvl = current_indent_lvl
+    dest
+        Writable binary file-like object that gets the PDF
 
-        # Add the li tag
-        with tag('li'):
-            b = re.sub('^(-+)', '', b)
-            b = b.strip()
-            doc.asis(b)
+    Returns
+    -------
+    pisaContext
+        Status of the conversion, which has errors if its err is non-zero
+    """
+    # pisa takes most of a second to import, so it is only loaded when needed
+    from xhtml2pdf import pisa
 
-    # Add in the remaining closing ul tags and add the list to the HTML
-    doc.asis('</ul>' * original_indent_lvl)
-    if cfg.VERBOSE: print('[INFO] Adding list')
-    upper, lower = html.split('</div></body>', 1)[0], html.split('</div></body>', 1)[1]
-    return upper + doc.getvalue() + "</div></body>" + lower
+    return pisa.CreatePDF(raw_html, dest=dest, default_css=theme, debug=1,
+        link_callback=lambda uri, rel: images.get(uri, uri))
 
 
-def generatePageSize(html: str, style: sty.Styler) -> str:
-    """Sets the page size of the document
+def generateBulletPoints(html: HtmlDocument, bullets: [str]) -> HtmlDocument:
+    """Generates bullet point list for a document
 
     Parameters
     ----------
     html
-        The HTML document that will have its page size changed
-
-    style
-        Styler object that contains new page size information
+        The HTML document to get the new bullet list
+    
+    bullets
+        Lines that contain the bullets, which may be any iterable
 
     Returns
     -------
-    str
-        The HTML document with the new page size
+    HtmlDocument
+        The HTML document with new bullet list
+
     """
-    doc, tag, text, line = Doc().ttl()
-    style.width, style.height = 1, 1
-    upper, lower = html.split('/*EndOf@pageManualStyling*/}', 1)[0], html.split('/*EndOf@pageManualStyling*/}', 1)[1]
-    doc.asis('size: {} {}; @frame {{top: {}cm; left: {}cm; height: {}cm; width: {}cm;}}'.format(style.pagesize, style.orientation, style.top, style.left, style.height, style.width))
-    upper = re.sub(r'size:.*;}', doc.getvalue(), upper)
-    if cfg.VERBOSE: print('[INFO] Setting page size to {}'.format(style.pagesize))
-    return upper + "/*EndOf@pageManualStyling*/}" + lower
+    # Count the level of indent of each bullet from its dashes
+    log.info('Adding list')
+    html.addBullets((b.split()[0].count('-'), b.lstrip('-').strip()) for b in bullets)
+    return html
 
 
-def generateTable(html: str, head: [str], rows: [str]) -> str:
+def generateTable(html: HtmlDocument, head: [str], rows: [str], chunk_rows: int = None) -> HtmlDocument:
     """Generates a table to insert into the document
 
     Parameters
@@ -221,34 +373,29 @@ def generateTable(html: str, head: [str], rows: [str]) -> str:
         Header row of the new table
 
     rows
-        Body rows of the new table
+        Body rows of the new table, which may be any iterable
+
+    chunk_rows
+        Number of rows that long tables are split after, from tableChunkRows.
+        Tables are never split if it is None.
 
     Returns
     -------
-    str
+    HtmlDocument
         The HTML document with the new table
     """
-    doc, tag, text, line = Doc().ttl()
+    log.info('Generating table')
+    html.addTable([i.strip() for i in head], (tableCells(r) for r in rows), chunk_rows)
+    return html
 
-    # Generate table header
-    with tag('table'):
-        if cfg.VERBOSE: print('[INFO] Generating table header')
-        with tag('tr'):
-            for i in head: 
-                with tag('th'): 
-                    doc.asis(i.strip())
-        
-        # Generate content in table
-        if cfg.VERBOSE: print('[INFO] Generating table rows')
-        for r in rows:
-            with tag('tr'):
-                r = r.split(';')
-                with tag('td'): doc.asis(r[0][2:])
-                for s in r[1:]:
-                    with tag('td'):
-                        doc.asis(s.strip())
-
-    # Insert table into doc
-    if cfg.VERBOSE: print('[INFO] Inserting table')
-    upper, lower = html.split('</div></body>', 1)[0], html.split('</div></body>', 1)[1]
-    return upper + doc.getvalue() + '</div></body>' + lower
+
+def tableCells(row: str) -> [str]:
+    """ Splits a formatted table row into its cells, in place in a single list """
+    cells = row[2:].split(';')
+    for i in range(1, len(cells)): cells[i] = cells[i].strip()
+    return cells
+
+
+def tableChunkRows(style: sty.Styler) -> int:
+    """ Returns how many rows long tables are split after, TABLE_CHUNK_PAGES pages of single line rows """
+    return max(1, int(style.height * POINTS_PER_CM / TABLE_ROW_HEIGHT)) * TABLE_CHUNK_PAGES
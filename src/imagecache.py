@@ -0,0 +1,337 @@
+from src.foldercache import FolderCache
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import glob
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+# Extensions kept on cached images, anything else is stored as .img
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+def isWebImage(src: str) -> bool:
+    """ Checks if an image source is a URL rather than a local file """
+    return src.startswith(('http://', 'https://'))
+
+
+def download(url: str, filename: str, max_bytes: int, timeout: float) -> int:
+    """Downloads a file, moving it into place only once it is complete
+
+    Parameters
+    ----------
+    url
+        Address of the file
+
+    filename
+        Path to save the file to
+
+    max_bytes
+        Largest file that will be downloaded
+
+    timeout
+        Seconds that the whole download may take
+
+    Returns
+    -------
+    int
+        Size of the file in bytes
+
+    Raises
+    ------
+    OSError
+        If the download failed, was too large or took too long
+    """
+    import urllib.request
+
+    deadline = time.monotonic() + timeout
+    tmp_filename = filename + '.' + uuid.uuid4().hex
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response, open(tmp_filename, 'wb') as f:
+            if int(response.headers.get('Content-Length') or 0) > max_bytes:
+                raise OSError('image is larger than {} bytes'.format(max_bytes))
+            size = 0
+            while True:
+                chunk = response.read(64 * 1024)
+                if not chunk: break
+                size += len(chunk)
+                if size > max_bytes: raise OSError('image is larger than {} bytes'.format(max_bytes))
+                if time.monotonic() > deadline: raise TimeoutError('download took longer than {} seconds'.format(timeout))
+                f.write(chunk)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename): os.remove(tmp_filename)
+    return size
+
+
+def waitFor(images: dict) -> dict:
+    """Waits for the images of a compile to be downloaded and scaled, warning
+    about any that failed. Images that could not be downloaded are left out,
+    and images that could not be scaled are used as they are, as their src.
+
+    Parameters
+    ----------
+    images
+        {src in the document: (image named in the note, future from
+        ImageCache.prepare)}, cleared once waited for
+
+    Returns
+    -------
+    dict
+        The file to embed for each src that was downloaded
+    """
+    paths = {}
+    for src, (name, future) in images.items():
+        error = future.exception()
+        if error is None: paths[src] = future.result()
+        elif isinstance(error, FetchError): print('[WARN] Could not fetch image {}, leaving it out: {}'.format(name, error.__cause__))
+        else:
+            print('[WARN] Could not scale image {}, using it as is: {}'.format(name, error))
+            paths[src] = src
+    images.clear()
+    return paths
+
+
+def pixels(cm: float, dpi: int) -> int:
+    """ Converts a length on the page into a number of pixels """
+    return max(1, round(cm / 2.54 * dpi))
+
+
+class FetchError(Exception):
+    """ Raised when an image to be scaled could not be downloaded """
+
+
+class ImageCache(FolderCache):
+    """LRU cache of images from the web, and of images scaled down to fit the
+    page. Each web image is downloaded once in a background thread into a
+    folder, under the hash of its URL, so its local path is known before it has
+    finished downloading. Images are fetched again once they are max_age
+    seconds old, and images that could not be fetched are not tried again for
+    retry_after seconds, so a host that is down only slows the first compile
+    that uses it.
+
+    The folder can be shared by caches in several processes, such as renders
+    that each run in their own process. Images one process saved are picked up
+    from the folder by the others, and failed downloads are recorded there as
+    <key>.failed files, so the back-off holds across processes too.
+
+    Images larger than the frame they are placed in are scaled down and
+    recompressed in a second thread pool, and stored under the hash of their
+    contents and the size they were scaled to. The least recently used images
+    of either kind are deleted once there are too many or they take up too
+    much space.
+    """
+    kind = 'image'
+
+    def __init__(self, directory: str, max_entries: int = 1024, max_bytes: int = 256 * 1024 * 1024,
+            max_image_bytes: int = 10 * 1024 * 1024, max_age: float = 24 * 60 * 60, timeout: float = 10,
+            retry_after: float = 60, max_workers: int = 8, quality: int = 85):
+        self.max_image_bytes = max_image_bytes
+        self.max_age = max_age
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.max_workers = max_workers
+        self.quality = quality
+        self.fetching = {} # {key: future}
+        self.failed = {} # {key: (time failed, future)}
+        self.digests = {} # {(path, modification time, size): hash of contents}
+        self._pool = None
+        self._scale_pool = None
+        super().__init__(directory, IMAGE_EXTENSIONS + ('.img',), max_entries, max_bytes)
+
+
+    def key(self, url: str) -> str:
+        """ Returns the cache key of an image """
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+    def path(self, url: str) -> str:
+        """ Returns the path that an image is stored at """
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        if ext not in IMAGE_EXTENSIONS: ext = '.img'
+        return os.path.join(self.directory, self.key(url) + ext)
+
+
+    def request(self, src: str) -> tuple:
+        """Gets the local path to an image, starting to download it if it is not
+        already cached
+
+        Parameters
+        ----------
+        src
+            URL or path of the image. Local paths are returned as they are.
+
+        Returns
+        -------
+        tuple
+            The path to give the <img> tag, and the future of the download, or
+            None if the image is already there
+        """
+        if not isWebImage(src): return src, None
+        key, filename = self.key(src), self.path(src)
+
+        with self._lock:
+            if key in self.fetching: return filename, self.fetching[key]
+            if key in self.failed:
+                failed_at, future = self.failed[key]
+                if time.time() - failed_at <= self.retry_after: return filename, future
+                del self.failed[key]
+            future = self._recordedFailure(key)
+            if future is not None: return filename, future
+
+            # Images are fetched again once the download in the folder is too old
+            if self._entry(key, filename) is not None and time.time() - os.path.getmtime(filename) <= self.max_age:
+                self._use(key, filename)
+                self.hits += 1
+                return filename, None
+
+            self.misses += 1
+            if self._pool is None: self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='image-fetch')
+            future = self.fetching[key] = self._pool.submit(self._fetch, src, key, filename)
+        return filename, future
+
+
+    def failurePath(self, key: str) -> str:
+        """ Returns the path that a failed download of an image is recorded at """
+        return os.path.join(self.directory, key + '.failed')
+
+
+    def _recordedFailure(self, key: str):
+        """ Returns a failed future for an image that any process could not fetch in the last retry_after seconds, or None. Must hold the lock """
+        try:
+            failed_at = os.stat(self.failurePath(key)).st_mtime
+            if time.time() - failed_at > self.retry_after: return None
+            with open(self.failurePath(key), encoding='utf-8') as f: message = f.read()
+        except OSError: return None
+
+        future = Future()
+        future.set_exception(OSError(message))
+        self.failed[key] = (failed_at, future)
+        return future
+
+
+    def _fetch(self, url: str, key: str, filename: str) -> str:
+        """ Downloads an image into the cache, run in the thread pool """
+        try: size = download(url, filename, self.max_image_bytes, self.timeout)
+        except BaseException as e:
+            with self._lock: self.failed[key] = (time.time(), self.fetching.pop(key))
+            try:
+                with open(self.failurePath(key), 'w', encoding='utf-8') as f: f.write('{}: {}'.format(type(e).__name__, e))
+            except OSError: pass
+            raise
+
+        try: os.remove(self.failurePath(key))
+        except OSError: pass
+        with self._lock:
+            del self.fetching[key]
+            self._add(key, size)
+        return filename
+
+
+    def prepare(self, src: str, fetch, width: int, height: int):
+        """Starts scaling an image down to fit in a frame, in the background
+
+        Parameters
+        ----------
+        src
+            Local path to the image, as returned by request
+
+        fetch
+            Future of the image's download, or None if it is already there
+
+        width
+            Width of the frame in pixels
+
+        height
+            Height of the frame in pixels
+
+        Returns
+        -------
+        Future
+            Resolves to the path of the file to embed, which is src itself if
+            the image already fits. Raises FetchError if the download failed.
+        """
+        with self._lock:
+            if self._scale_pool is None: self._scale_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='image-scale')
+            return self._scale_pool.submit(self._scale, src, fetch, width, height)
+
+
+    def digest(self, filename: str) -> str:
+        """ Returns the hash of a file's contents, only reading it again if it has changed """
+        st = os.stat(filename)
+        file_id = (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+        digest = self.digests.get(file_id)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''): h.update(chunk)
+            if len(self.digests) > 4096: self.digests.clear()
+            digest = self.digests[file_id] = h.hexdigest()
+        return digest
+
+
+    def _scale(self, src: str, fetch, width: int, height: int) -> str:
+        """ Scales and recompresses an image into the cache, run in the scaling thread pool """
+        if fetch is not None:
+            try: fetch.result()
+            except Exception as e: raise FetchError(src) from e
+
+        key = '{}-{}x{}'.format(self.digest(src), width, height)
+        with self._lock:
+            for ext in ('.jpg', '.png'):
+                filename = os.path.join(self.directory, key + ext)
+                if self._entry(key, filename) is not None:
+                    self._use(key, filename)
+                    self.hits += 1
+                    return filename
+
+        from PIL import Image, ImageOps
+        with Image.open(src) as image:
+            if image.width <= width and image.height <= height: return src
+
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((width, height), Image.LANCZOS)
+
+            # Photos become JPEGs, anything with transparency stays lossless
+            if image.mode in ('RGBA', 'LA', 'P') or 'transparency' in image.info:
+                filename, options = os.path.join(self.directory, key + '.png'), {'format': 'PNG', 'optimize': True}
+            else:
+                image = image.convert('RGB')
+                filename, options = os.path.join(self.directory, key + '.jpg'), {'format': 'JPEG', 'quality': self.quality, 'optimize': True}
+
+            tmp_filename = filename + '.' + uuid.uuid4().hex
+            try:
+                image.save(tmp_filename, **options)
+                os.replace(tmp_filename, filename)
+            finally:
+                if os.path.exists(tmp_filename): os.remove(tmp_filename)
+
+        with self._lock:
+            self.misses += 1
+            self._add(key, os.path.getsize(filename))
+        return filename
+
+
+    def sweep(self, grace: float = 10 * 60):
+        """ Sweeps the cache like FolderCache.sweep, and deletes records of failed downloads that have run out """
+        super().sweep(grace)
+        now = time.time()
+        for filename in glob.glob(os.path.join(self.directory, '*.failed')):
+            try:
+                if now - os.stat(filename).st_mtime > self.retry_after: os.remove(filename)
+            except OSError: pass
+
+
+# Cache shared by every compile in this process, created when first used
+_shared = None
+_shared_lock = threading.Lock()
+
+def sharedCache() -> ImageCache:
+    """ Returns the process-wide image cache, stored in RNOTE_IMAGE_CACHE or temp/img """
+    global _shared
+    with _shared_lock:
+        if _shared is None: _shared = ImageCache(os.environ.get('RNOTE_IMAGE_CACHE', 'temp/img'))
+        return _shared
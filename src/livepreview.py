@@ -0,0 +1,110 @@
+from src import generator as gen
+from src import parser as parser
+from src import styling as sty
+from src import cfg
+
+import hashlib
+import io
+import threading
+
+from collections import OrderedDict
+from datetime import date
+
+# Styling added to the theme so a browser lays the note out at the width of the page's frame
+FRAME_CSS = '#content {{ width: {:.2f}cm; margin: 0 auto; }}'
+
+# HTML of the blocks parsed by this process, shared by every preview, as
+# {(date, page geometry, block): HTML}. Notes are sent again on every edit, so
+# most of their blocks are found here
+FRAGMENTS = OrderedDict()
+MAX_FRAGMENTS = 16384
+FRAGMENTS_LOCK = threading.Lock()
+
+def blockId(fragment: str) -> str:
+    """ Returns the id a piece of HTML or CSS is known by, a hash of it """
+    return hashlib.sha1(fragment.encode('utf-8')).hexdigest()[:16]
+
+
+def parseBlocks(text: str, style: sty.Styler) -> tuple:
+    """Parses a note into the HTML of each of its blocks, without rendering it.
+    Blocks that only change settings, such as .pp commands, have no HTML and
+    are left out.
+
+    Parameters
+    ----------
+    text
+        The RNote source of the note
+
+    style
+        Styler object that the note's settings are applied to
+
+    Returns
+    -------
+    tuple
+        (id, HTML) of each block in order, and the title of the note
+    """
+    ctx = style.ctx
+    today = date.today()
+    raw_html = gen.generateHtmlHeader(style)
+    blocks = []
+    for line_no, block in parser.splitBlocks(io.StringIO(text, newline=None), ctx=ctx):
+        ctx.line_no = line_no
+
+        # Preprocessor commands change the style, so they are always parsed
+        if block[0].startswith('.pp'):
+            raw_html = parser.parseBlock(block, style, raw_html)
+            continue
+
+        # Tables are split by the page size, so blocks are kept per page geometry
+        key = (today, style.geometry, block)
+        with FRAGMENTS_LOCK:
+            found = FRAGMENTS.get(key)
+            if found is not None: FRAGMENTS.move_to_end(key)
+        if found is None:
+            start = len(raw_html.body)
+            raw_html = parser.parseBlock(block, style, raw_html)
+            fragment = ''.join(raw_html.body[start:])
+            found = (blockId(fragment), fragment)
+            with FRAGMENTS_LOCK:
+                FRAGMENTS[key] = found
+                while len(FRAGMENTS) > MAX_FRAGMENTS: FRAGMENTS.popitem(last=False)
+        if found[1]: blocks.append(found)
+    return blocks, raw_html.title
+
+
+def livePreview(text: str, have=(), css_id: str = None) -> dict:
+    """Builds the themed HTML of a note for a browser to show while it is being
+    written, as a much faster stand-in for the PDF. Clients send the ids of the
+    blocks and stylesheet they already have, and only get the HTML of the rest.
+
+    Parameters
+    ----------
+    text
+        The RNote source of the note
+
+    have
+        Ids of the blocks the client already has the HTML of
+
+    css_id
+        Id of the stylesheet the client already has
+
+    Returns
+    -------
+    dict
+        The 'title' of the note, its 'blocks' in order as {'id'} with the
+        'html' of any the client does not have, and the 'css' and its 'css_id'.
+        The css is left out if it has not changed.
+    """
+    style = sty.Styler(cfg.Context(prepare_images=False))
+    blocks, title = parseBlocks(text, style)
+
+    have = set(have)
+    preview = {'title': title.strip(), 'blocks': []}
+    for block_id, fragment in blocks:
+        preview['blocks'].append({'id': block_id} if block_id in have else {'id': block_id, 'html': fragment})
+        have.add(block_id)
+
+    css = style.theme + '\n' + FRAME_CSS.format(style.width)
+    preview['css_id'] = blockId(css)
+    if preview['css_id'] != css_id: preview['css'] = css
+    return preview
@@ -1,20 +1,37 @@
-class PageDimensions:
-    def __init__(self, w: int, h: int):
-        self.width = w
-        self.height = h
-    
-    @property
-    def width(self):
-        return self._width
+from types import MappingProxyType
+from typing import NamedTuple
 
-    @width.setter
-    def width(self, wi):
-        self._width = wi
-    
-    @property
-    def height(self):
-        return self._height
+class PageDimensions(NamedTuple):
+    """ Width and height of a page size in cm. Immutable, so every Styler shares one table of them """
+    width: float
+    height: float
 
-    @height.setter
-    def height(self, hi):
-        self._height = hi
+
+# Page sizes by name, ordered as WxH in cm
+PAGE_SIZES = MappingProxyType({
+    'a0': PageDimensions(84.1, 118.9),
+    'a1': PageDimensions(59.4, 84.1),
+    'a2': PageDimensions(42.0, 59.4),
+    'a3': PageDimensions(29.7, 42.0),
+    'a4': PageDimensions(21.0, 29.7),
+    'a5': PageDimensions(14.8, 21.0),
+    'a6': PageDimensions(10.5, 14.8),
+    'b0': PageDimensions(100.0, 141.4),
+    'b1': PageDimensions(59.4, 84.1),
+    'b2': PageDimensions(42.0, 59.4),
+    'b3': PageDimensions(29.7, 42.0),
+    'b4': PageDimensions(21.0, 29.7),
+    'b5': PageDimensions(14.8, 21.0),
+    'b6': PageDimensions(10.5, 14.8),
+    'elevenseventeen': PageDimensions(27.94, 43.1),
+    'legal': PageDimensions(21.59, 35.56),
+    'letter': PageDimensions(21.59, 27.94)
+})
+
+# Margins by name as (top and bottom, left and right) in cm
+MARGINS = MappingProxyType({
+    'normal': (2.0, 2.0),
+    'narrow': (1.0, 1.0),
+    'moderate': (1.0, 0.75),
+    'wide': (1.0, 2.0)
+})
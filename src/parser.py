@@ -1,13 +1,35 @@
+from src import pagedimensions as pd
 from src import styling as sty
 from src import generator as gen
 from src import cfg
+from src import imagecache as imagecache
 
+import logging
+import os
 import re
 
 from datetime import date
-from itertools import islice
+from itertools import chain
 
-def parseRNoteDoc(doc: [str], style: sty.Styler, raw_html: str) -> str:
+log = logging.getLogger(__name__)
+
+# Kinds of block, by the prefix of their first line. Used to name profiling phases
+BLOCK_KINDS = (('.pp', 'preprocessor'), ('$table', 'table'), ('$', 'insert'), ('# ', 'header'),
+    ('@ ', 'header'), ('! ', 'header'), ('-', 'bullets'), ('= ', 'paragraph'))
+
+# Fraction of the frame height that placeholders for web images take up in previews
+PLACEHOLDER_HEIGHT = 0.25
+
+# Spellings of the .pp command that applies a template
+TEMPLATE_COMMANDS = ('template', 'temp', 'templ8')
+
+# Page orientation of each spelling that .pp align accepts
+ORIENTATIONS = {
+    'port': 'portrait', 'portrait': 'portrait', 'vert': 'portrait', 'verical': 'portrait',
+    'land': 'landscape', 'landscape': 'landscape', 'horz': 'landscape', 'horizontal': 'landscape'
+}
+
+def parseRNoteDoc(doc: [str], style: sty.Styler, raw_html: gen.HtmlDocument, fragments: dict = None) -> str:
     """Parses an input document into an HTML document to later be converted into
     a PDF.
 
@@ -20,76 +42,254 @@ def parseRNoteDoc(doc: [str], style: sty.Styler, raw_html: str) -> str:
         Styler object containing style information about the document
 
     raw_html
-        The HTML of the document
+        The HTML document model that parsed blocks are appended to
+
+    fragments
+        HTML fragments of the blocks of a previous parse, keyed by page geometry
+        and block. Blocks found here are reused instead of being parsed again,
+        and the dict is updated to hold the blocks of this document.
 
     Returns
     -------
     str
-        The HTML document that will be turned into a PDF
+        The serialized HTML document that will be turned into a PDF
+    """
+    ctx = style.ctx
+    previous = {}
+    if fragments is not None:
+        previous = dict(fragments)
+        fragments.clear()
+
+    for line_no, block in splitBlocks(doc, ctx=ctx):
+        ctx.line_no = line_no
+
+        # Preprocessor commands change the style, and images are prepared for
+        # each compile, so they are always parsed
+        if fragments is None or block[0].startswith(('.pp', '$wi', '$li')):
+            raw_html = parseBlock(block, style, raw_html)
+            continue
+
+        # Tables are split by the page size, so blocks are kept per page geometry
+        key = (style.geometry, block)
+        if key in previous: raw_html.body += previous[key]
+        else:
+            start = len(raw_html.body)
+            raw_html = parseBlock(block, style, raw_html)
+            previous[key] = raw_html.body[start:]
+        fragments[key] = previous[key]
+    return raw_html.getvalue()
+
+
+def streamRNoteDoc(doc, style: sty.Styler, raw_html: gen.HtmlDocument, sink):
+    """Parses an input document like parseRNoteDoc, but streams it from any
+    iterable of lines and writes the HTML to a file-like object. Tables and
+    bullet lists are processed a row at a time and the body is spooled to a
+    temporary file, so memory use does not grow with the size of the document.
+
+    Parameters
+    ----------
+    doc
+        Iterable of lines from the input document, such as an open file
+
+    style
+        Styler object containing style information about the document
+
+    raw_html
+        The HTML document model that parsed blocks are appended to
+
+    sink
+        Writable text file-like object that gets the HTML document
     """
-    cfg.LINE_NO = 0
-    doc_iter = iter(doc)
+    raw_html.spoolBody()
+    raw_html = buildRNoteDoc(doc, style, raw_html)
+    raw_html.writeTo(sink)
+
+
+def buildRNoteDoc(doc, style: sty.Styler, document):
+    """Parses an input document a block at a time into any document model that
+    has the methods of HtmlDocument, such as flowables.FlowableDocument
+
+    Parameters
+    ----------
+    doc
+        Iterable of lines from the input document, such as an open file
+
+    style
+        Styler object containing style information about the document
+
+    document
+        The document model that parsed blocks are added to
+
+    Returns
+    -------
+    gen.HtmlDocument or flowables.FlowableDocument
+        The document model with every block of the input document added
+    """
+    ctx = style.ctx
+    for line_no, block in splitBlocks(doc, lazy=True, ctx=ctx):
+        ctx.line_no = line_no
+        document = parseBlock(block, style, document)
+    return document
+
+
+class LineReader:
+    """Iterates over the lines of a document, counting them and stripping line
+    endings. The last line read can be put back to be read again.
+    """
+    def __init__(self, doc):
+        self.doc_iter = iter(doc)
+        self.line_no = 0
+        self.pushed = None
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self) -> str:
+        if self.pushed is not None: l, self.pushed = self.pushed, None
+        else: l = next(self.doc_iter).rstrip('\r\n')
+        self.line_no += 1
+        return l
+
 
-    for l in doc_iter:
+    def pushBack(self, l: str):
+        """ Puts a line back so it is read again next """
+        self.pushed = l
+        self.line_no -= 1
+
+
+def splitBlocks(doc, lazy: bool = False, ctx: cfg.Context = None):
+    """Splits the lines of a document into blocks. A block is a table, a run of
+    bullet points, or any other single line. Comments and blank lines are
+    skipped.
+
+    Parameters
+    ----------
+    doc
+        Iterable of lines from the input document
+
+    lazy
+        If True, the lines of tables and bullet lists are read from the document
+        as the block is iterated over instead of all at once. Each block must
+        then be used before moving on to the next one.
+
+    ctx
+        Context of the compile, used for error messages and profiling
+
+    Yields
+    ------
+    (int, tuple)
+        The line number that the block starts on, and the lines of the block
+    """
+    if ctx is None: ctx = cfg.Context()
+    lines = LineReader(doc if ctx.profiler is None else ctx.profiler.timed('read', doc))
+
+    for l in lines:
         l = l.strip()
-        cfg.LINE_NO += 1
+        start = lines.line_no
 
         if l.startswith('//') or l == '':
-            if cfg.VERBOSE: print('[INFO] Encountered comment or blank line on line {}; skipping'.format(cfg.LINE_NO))
+            log.info('Encountered comment or blank line on line %s; skipping', start)
             continue
-        elif l.startswith('.pp'):
-            if cfg.VERBOSE: print('[INFO] Parsing preprocessor command'.format(cfg.LINE_NO))
+        elif l.startswith('$table'):
+            log.info('Reading table beginning on line %s', start)
+            rows = tableRows(lines, start)
+        elif l.startswith('-'):
+            log.info('Reading bullet point list beginning on line %s', start)
+            rows = bulletRows(lines)
+        else:
+            yield start, (l,)
+            continue
+
+        if lazy:
+            yield start, chain((l,), rows)
+            for _ in rows: pass
+        else: yield start, (l,) + tuple(rows)
+
+
+def tableRows(lines: LineReader, start: int):
+    """ Yields the rows of a table up to $endtable, skipping invalid lines """
+    for j in lines:
+        if j.startswith('-'): yield j
+        elif j == '$endtable': return
+        else: print('[ERR!] Syntax error when processing table, expecting table row or $endtable')
+    print('[ERR!] Table beginning on line {} is missing $endtable'.format(start))
+
+
+def bulletRows(lines: LineReader):
+    """ Yields the bullets of a list after its first, up to the first other line """
+    for j in lines:
+        if not j.startswith('-'):
+            lines.pushBack(j)
+            return
+        yield j
+
+
+def blockKind(l: str) -> str:
+    """ Returns the kind of block that starts with a line, such as 'table' """
+    for prefix, kind in BLOCK_KINDS:
+        if l.startswith(prefix): return kind
+    return 'unknown'
+
+
+def parseBlock(block: tuple, style: sty.Styler, raw_html: gen.HtmlDocument) -> gen.HtmlDocument:
+    """Parses a single block of the document into HTML
+
+    Parameters
+    ----------
+    block
+        Lines of the block, as returned by splitBlocks
+
+    style
+        Styler object containing style information about the document
+
+    raw_html
+        HTML of the document being created
+
+    Returns
+    -------
+    gen.HtmlDocument
+        The HTML document with the new block
+    """
+    ctx = style.ctx
+    rows = iter(block)
+    l = next(rows)
+
+    with ctx.phase('parse ' + blockKind(l)):
+        if l.startswith('.pp'):
+            log.info('Parsing preprocessor command on line %s', ctx.line_no)
             raw_html = parsePpCommand(l, style, raw_html)
         elif l.startswith('$table'):
-            if cfg.VERBOSE: print('[INFO] Inserting table beginning on line {}'.format(cfg.LINE_NO))
-
-            # Get table header
-            table_header = ' '.join(l.split()[1:]).split(';')
-            table_list = []
-
-            # Get table body lines
-            for j in islice(doc_iter, 0, None):
-                if j.startswith('-'):
-                    table_list.append(j)
-                elif j ==('$endtable'):
-                    cfg.LINE_NO += len(table_list)
-                    for k in range(len(table_header)): table_header[k] = formatText(table_header[k])
-                    for k in range(len(table_list)): table_list[k] = formatText(table_list[k])
-                    raw_html = gen.generateTable(raw_html, table_header, table_list)
-                    break
-                else: print('[ERR!] Syntax error when processing table, expecting table row or $endtable')
+            log.info('Inserting table beginning on line %s', ctx.line_no)
+
+            # Get table header and body lines
+            table_header = formatLines(' '.join(l.split()[1:]).split(';'), ctx)
+            raw_html = gen.generateTable(raw_html, table_header, formatLines(rows, ctx), gen.tableChunkRows(style))
         elif l.startswith('$'):
-            if cfg.VERBOSE: print('[INFO] Parsing insert command')
-            raw_html = parseInsCommand(l, raw_html)
+            log.info('Parsing insert command')
+            raw_html = parseInsCommand(l, style, raw_html)
         elif l.startswith('# '):
-            if cfg.VERBOSE: print('[INFO] Parsing level one header')
+            log.info('Parsing level one header')
             raw_html = parseHtmlElement(l, raw_html, '# *', 'h1')
         elif l.startswith('@ '):
-            if cfg.VERBOSE: print('[INFO] Parsing level two header')
+            log.info('Parsing level two header')
             raw_html = parseHtmlElement(l, raw_html, '@ *', 'h2')
         elif l.startswith('! '):
-            if cfg.VERBOSE: print('[INFO] Parsing level three header')
+            log.info('Parsing level three header')
             raw_html = parseHtmlElement(l, raw_html, '! *', 'h3')
         elif l.startswith('-'):
-            # List all bullet points
-            if cfg.VERBOSE: print('[INFO] Parsing bullet point list')
-            bullet_list = [l]
-            for j in islice(doc_iter, 0, None):
-                if j.startswith('-'): bullet_list.append(j)
-                else: break
-
             # Process bullet points into document
-            cfg.LINE_NO += len(bullet_list)
-            for j in range(len(bullet_list)): bullet_list[j] = formatText(bullet_list[j])
-            raw_html = gen.generateBulletPoints(raw_html, bullet_list)
+            log.info('Parsing bullet point list')
+            raw_html = gen.generateBulletPoints(raw_html, formatLines(chain((l,), rows), ctx))
         elif l.startswith('= '):
-            if cfg.VERBOSE: print('[INFO] Parsing level one header')
+            log.info('Parsing paragraph')
             raw_html = parseHtmlElement(l, raw_html, '= *', 'p')
-        else: print("[ERR!] Error on or around line {}, could not determine formatting on the following line:\n  >> {}".format(cfg.LINE_NO, l))
+        else: print("[ERR!] Error on or around line {}, could not determine formatting on the following line:\n  >> {}".format(ctx.line_no, l))
     return raw_html
 
 
-def parsePpCommand(l: str, style: sty.Styler, raw_html: str) -> str:
+def parsePpCommand(l: str, style: sty.Styler, raw_html: gen.HtmlDocument) -> gen.HtmlDocument:
     """Parses commands that are prefaced with .pp
 
     Parameters
@@ -105,80 +305,164 @@ def parsePpCommand(l: str, style: sty.Styler, raw_html: str) -> str:
 
     Returns
     -------
-    str
+    gen.HtmlDocument
         The HTML document with new .pp attribute
     """
+    return applySettings(resolvePpCommand(l, style.ctx), style, raw_html)
+
+
+def applySettings(settings: [tuple], style: sty.Styler, raw_html: gen.HtmlDocument) -> gen.HtmlDocument:
+    """Applies resolved preprocessor settings to the document. Settings that
+    change the page only change the styler, which the @page styling is read
+    from once the document is serialized.
+
+    Parameters
+    ----------
+    settings
+        Settings as returned by resolvePpCommand
+
+    style
+        Styler object containing styling information for document
+
+    raw_html
+        HTML of the document being created
+
+    Returns
+    -------
+    gen.HtmlDocument
+        The HTML document with the new settings
+    """
+    for name, value in settings:
+        if name == 'title': raw_html = gen.insertDocTitleIntoHtml(raw_html, value)
+        else: setattr(style, name, value)
+    return raw_html
+
+
+def resolvePpCommand(l: str, ctx: cfg.Context = None) -> [tuple]:
+    """Resolves a command prefaced with .pp into the settings that it changes,
+    without applying them to a document
+
+    Parameters
+    ----------
+    l
+        Command to be resolved
+
+    ctx
+        Context of the compile, used for error messages and profiling
+
+    Returns
+    -------
+    [tuple]
+        The settings as (name, value) pairs in the order they are applied. The
+        names are Styler attributes, or 'title' for the document title
+    """
+    if ctx is None: ctx = cfg.Context()
+
     # Remove the .pp part of the string, then split it into a list
     l = re.sub('.pp *', '', l)
     cmd = l.split()
 
     if cmd[0] == 'theme': 
-        if cfg.VERBOSE: print('[INFO] Parsing theme preprocessor command')
-        style.theme = cmd[1]
+        log.info('Parsing theme preprocessor command')
+        return [('theme', cmd[1])]
     elif cmd[0] == 'margin' or cmd[0] == 'margins':
-        if cfg.VERBOSE: print('[INFO] Parsing margin preprocessor command')
+        log.info('Parsing margin preprocessor command')
         new_margins = cmd[1]
-        style.margin = new_margins
 
         # Set the margins
-        if cfg.VERBOSE: print('[INFO] Setting margins to {}'.format(new_margins))
-        if new_margins == 'normal': style.topBottom = style.leftRight = 2
-        elif new_margins == 'narrow': style.topBottom = style.leftRight = 1
-        elif new_margins == 'moderate': style.topBottom, style.leftRight = 1, 0.75
-        elif new_margins == 'wide': style.topBottom, style.leftRight = 1, 2
-        else:
-            print('[ERR!] Error on or around line {}, could not determine margin size, defaulting to normal margins.\n').format(cfg.LINE_NO)
-            style.topBottom = style.leftRight = 2
-            style.margin = 'normal'
-        raw_html = gen.generatePageSize(raw_html, style)
+        log.info('Setting margins to %s', new_margins)
+        if new_margins not in pd.MARGINS:
+            print('[ERR!] Error on or around line {}, could not determine margin size, defaulting to normal margins.\n'.format(ctx.line_no))
+            new_margins = 'normal'
+        return [('margin', new_margins)]
     elif cmd[0] == 'size':
-        if cfg.VERBOSE: print('[INFO] Setting new page size')
+        log.info('Setting new page size')
         new_size = cmd[1].lower()
 
-        # Build list of allowed sizes
-        allowed_sizes = ['letter', 'legal', 'elevenseventeen']
-        for i in range(7):
-            allowed_sizes.append('a{}'.format(i))
-            allowed_sizes.append('b{}'.format(i))
-
         # Check if size is allowed
-        if new_size in allowed_sizes:
-            if cfg.VERBOSE: print('[INFO] Setting page size to {}'.format(new_size))
-            style.pagesize = new_size
+        if new_size in pd.PAGE_SIZES:
+            log.info('Setting page size to %s', new_size)
         else:
-            print('[ERR!] Error on or around line {}, could not determine page size, defaulting to letter (8.5" x 11")\n').format(cfg.LINE_NO)
-            style.pagesize = 'letter'
-        raw_html = gen.generatePageSize(raw_html, style)
+            print('[ERR!] Error on or around line {}, could not determine page size, defaulting to letter (8.5" x 11")\n'.format(ctx.line_no))
+            new_size = 'letter'
+        return [('pagesize', new_size)]
     elif cmd[0] == 'align' or cmd[0] == 'orientation':
-        if cfg.VERBOSE: print('[INFO] Setting page orientation')
-        new_orient = cmd[1].lower()
+        log.info('Setting page orientation')
+        new_orient = ORIENTATIONS.get(cmd[1].lower())
 
         # Set orientation
-        if new_orient in ['port', 'portrait', 'vert','verical']: style.orientation = 'portrait'
-        elif new_orient in ['land', 'landscape', 'horz', 'horizontal']: style.orientation = 'landscape'
-        else:
-            print('[ERR!] Error on or around line {}, could not determine page orientation, defaulting to portrait').format(cfg.LINE_NO)
-            style.orientation = 'portrait'
-        if cfg.VERBOSE: print('[INFO] Setting page orientation to {}'.format(style.orientation))
-        raw_html = gen.generatePageSize(raw_html, style)
+        if new_orient is None:
+            print('[ERR!] Error on or around line {}, could not determine page orientation, defaulting to portrait'.format(ctx.line_no))
+            new_orient = 'portrait'
+        log.info('Setting page orientation to %s', new_orient)
+        return [('orientation', new_orient)]
     elif cmd[0] == 'title':
-        if cfg.VERBOSE: print('[INFO] Inserting new document title')
-        raw_html = gen.insertDocTitleIntoHtml(raw_html, re.sub('^title?', '', l))
-    elif cmd[0] == 'template' or cmd[0] == 'temp' or cmd[0] == 'templ8':
-        if cfg.VERBOSE: print('[INFO] Setting document template')
-        filename = cmd[1]
-        pp_commands = []
-
-        # Read in the new template
-        with open('tmplt/' + filename + '.rntp') as f: pp_commands = f.readlines()
-
-        # Process the template
-        for cmd in pp_commands: raw_html = parsePpCommand(cmd.strip(), style, raw_html)
-    else: print("[ERR!] Error on or around line {}, could not determine preprocessor command '{}'. Skipping this command.".format(cfg.LINE_NO, cmd[0]))
-    return raw_html
+        log.info('Inserting new document title')
+        return [('title', re.sub('^title?', '', l))]
+    elif cmd[0] in TEMPLATE_COMMANDS:
+        log.info('Setting document template')
+        return loadTemplate(cmd[1], ctx)
+    else: print("[ERR!] Error on or around line {}, could not determine preprocessor command '{}'. Skipping this command.".format(ctx.line_no, cmd[0]))
+    return []
+
+
+# Templates resolved by this process as {path: ({path of each file read: modification time}, settings)}
+TEMPLATES = {}
+
+def templateChanged(mtimes: dict) -> bool:
+    """ Checks if any of the files that a template was resolved from has changed since """
+    for path, mtime in mtimes.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime: return True
+        except OSError: return True
+    return False
+
+
+def loadTemplate(filename: str, ctx: cfg.Context = None) -> [tuple]:
+    """Loads a template from the tmplt/ folder and resolves its preprocessor
+    commands. Each template is resolved once per process, and again only if its
+    file, or the file of any template it uses, has changed.
+
+    Parameters
+    ----------
+    filename
+        Name of the template
+
+    ctx
+        Context of the compile, used for error messages and profiling
+
+    Returns
+    -------
+    [tuple]
+        The settings of the template, as returned by resolvePpCommand
+    """
+    path = 'tmplt/' + filename + '.rntp'
+    cached = TEMPLATES.get(path)
+    if cached is not None and not templateChanged(cached[0]): return cached[1]
 
+    # Read in the new template
+    mtimes = {path: os.stat(path).st_mtime_ns}
+    with open(path) as f: pp_commands = f.readlines()
 
-def parseInsCommand(l: str, raw_html: str) -> str:
+    # Resolve the template
+    settings = []
+    for cmd in pp_commands:
+        if not cmd.strip(): continue
+        settings += resolvePpCommand(cmd.strip(), ctx)
+
+        # Templates used by this one are checked for changes along with it
+        words = re.sub('.pp *', '', cmd.strip()).split()
+        if words[0] in TEMPLATE_COMMANDS: mtimes.update(TEMPLATES['tmplt/' + words[1] + '.rntp'][0])
+    TEMPLATES[path] = (mtimes, settings)
+    return settings
+
+
+def placeholderSize(style: sty.Styler) -> (float, float):
+    """ Returns the width and height in cm of the box drawn instead of a web image in draft previews """
+    return style.width, style.height * PLACEHOLDER_HEIGHT
+
+
+def parseInsCommand(l: str, style: sty.Styler, raw_html: gen.HtmlDocument) -> gen.HtmlDocument:
     """Parses commands that are prefaced with $
 
     Parameters
@@ -186,34 +470,53 @@ def parseInsCommand(l: str, raw_html: str) -> str:
     l
         Command to be parsed
 
+    style
+        Styler object containing styling information for document
+
     raw_html
         HTML of the document being created
 
     Returns
     -------
-    str
+    gen.HtmlDocument
         The HTML document with new $ attribute
     """
 
+    ctx = raw_html.ctx
+
     # Remove the $ part of the string, then split it into a list
     l = re.sub('\$', '', l)
     cmd = l.split()
     first = cmd[0]
 
     if first == 'br' or first == 'hr':
-        if cfg.VERBOSE: print('[INFO] Inserting line break')
+        log.info('Inserting line break')
         raw_html = gen.insertElementIntoHtml(raw_html, '', first)
     elif first == 'date':
-        if cfg.VERBOSE: print('[INFO] Inserting date')
+        log.info('Inserting date')
         raw_html = gen.insertElementIntoHtml(raw_html, str(date.today()), 'p')
     elif (first == 'wi' or first == 'li') and (len(cmd) >= 2):
-        if cfg.VERBOSE: print('[INFO] Inserting image')
-        raw_html = gen.insertImageIntoHtml(raw_html, cmd[1])
-    else: print("[ERR!] Error on or around line {}, cound not determine insert command '${}'. Skipping this command.".format(cfg.LINE_NO, first))
+        log.info('Inserting image')
+
+        # Web images are downloaded and images are scaled to fit the frame in
+        # the background while parsing goes on. Compiles that only write HTML
+        # keep images as the note names them
+        src = cmd[1]
+        if ctx.preview and imagecache.isWebImage(src):
+            raw_html.addPlaceholder(src, *placeholderSize(style))
+            return raw_html
+        if ctx.prepare_images:
+            cache = imagecache.sharedCache()
+            src, fetch = cache.request(cmd[1])
+            if src not in ctx.images:
+                width, height = imagecache.pixels(style.width, ctx.image_dpi), imagecache.pixels(style.height, ctx.image_dpi)
+                ctx.images[src] = (cmd[1], cache.prepare(src, fetch, width, height))
+        raw_html = gen.insertImageIntoHtml(raw_html, src)
+    else: print("[ERR!] Error on or around line {}, cound not determine insert command '${}'. Skipping this command.".format(ctx.line_no, first))
     return raw_html
 
 
-def parseHtmlElement(l: str, raw_html: str, pattern: str, element: str) -> str:
+def parseHtmlElement(l: str, raw_html: gen.HtmlDocument, pattern: str, element: str) -> gen.HtmlDocument:
     """Parses a HTML element
 
     Parameters
@@ -232,22 +535,23 @@ def parseHtmlElement(l: str, raw_html: str, pattern: str, element: str) -> str:
 
     Returns
     -------
-    str
+    gen.HtmlDocument
         The HTML document with new HTML element
     """
-    if cfg.VERBOSE: print('[INFO] Parsing HTML element')
+    ctx = raw_html.ctx
+    log.info('Parsing HTML element')
     l = re.sub(pattern, '', l)
 
     # Format text first
-    if cfg.VERBOSE: print('[INFO] Formatting text first')
-    l = formatText(l)
+    log.info('Formatting text first')
+    l = formatText(l, ctx)
 
-    if cfg.VERBOSE: print('[INFO] Inserting new HTML element')
+    log.info('Inserting new HTML element')
     raw_html = gen.insertElementIntoHtml(raw_html, l, element)
     return raw_html
 
 
-def formatText(l: str) -> str:
+def formatText(l: str, ctx: cfg.Context = None) -> str:
     """ Formats text for styling (bold, italics, etc.)
 
     Parameters
@@ -255,49 +559,171 @@ def formatText(l: str) -> str:
     l
         Line to be formatted
 
+    ctx
+        Context of the compile, used for error messages and profiling
+
     Returns
     -------
     str
         The formatted line
     """
-    l = re.sub('\$date', str(date.today()), l)
-    l = l.replace('\*', '&ast;')
-    l = l.replace('\_', '&lowbar;')
-    l = l.replace('\~', '&tilde;')
-    l = textFormatter(l, '***', '<b><i>', '</i></b>')
-    l = textFormatter(l, '**', '<b>', '</b>')
-    l = textFormatter(l, '*', '<i>', '</i>')
-    l = textFormatter(l, '__', '<u>', '</u>')
-    l = textFormatter(l, '~~', '<del>', '</del>')
+    if ctx is None: ctx = cfg.Context()
+    with ctx.phase('format'): return formatLine(l, str(date.today()), ctx)
+
+
+def formatLines(lines: [str], ctx: cfg.Context = None):
+    """Formats a run of lines for styling, such as the rows of a bullet list or
+    table. Lines are formatted as they are iterated over.
+
+    Parameters
+    ----------
+    lines
+        Lines to be formatted, which may be any iterable
+
+    ctx
+        Context of the compile, used for error messages and profiling
+
+    Yields
+    ------
+    str
+        The formatted lines, in the same order
+    """
+    today = str(date.today())
+    if ctx is None: ctx = cfg.Context()
+    if ctx.profiler is None:
+        for l in lines: yield formatLine(l, today, ctx)
+        return
+
+    for l in lines:
+        with ctx.phase('format'): l = formatLine(l, today, ctx)
+        yield l
+
+
+# Inline markup: the $date macro, escaped formatters and runs of formatter
+# characters
+INLINE_MARKUP = re.compile(r'\$date|\\[*_~]|\*+|_+|~+')
+ESCAPES = {'\\*': '&ast;', '\\_': '&lowbar;', '\\~': '&tilde;'}
+
+# Marker widths of each formatter character, widest first
+MARKER_WIDTHS = {'*': (3, 2, 1), '_': (2,), '~': (2,)}
+
+# Formatters in the order they are matched as (character, width, open, close)
+FORMATTERS = [
+    ('*', 3, '<b><i>', '</i></b>'),
+    ('*', 2, '<b>', '</b>'),
+    ('*', 1, '<i>', '</i>'),
+    ('_', 2, '<u>', '</u>'),
+    ('~', 2, '<del>', '</del>')
+]
+FORMATTER_TAGS = {(c, w): (o, e) for c, w, o, e in FORMATTERS}
+
+# Short runs of formatter characters that have already been split into markers
+MARKER_RUNS = {}
+
+def formatLine(l: str, today: str, ctx: cfg.Context = None) -> str:
+    """Formats a single line for styling in one pass over the line. Runs of a
+    formatter character are split into markers widest first, so '***' is matched
+    before '**' and '*'. Markers are then paired up in order of appearance, and
+    a marker that is left unpaired gets a closing marker at the end of the line.
+
+    Parameters
+    ----------
+    l
+        Line to be formatted
+
+    today
+        The date that $date is replaced with
+
+    ctx
+        Context of the compile, used for error messages and profiling
+
+    Returns
+    -------
+    str
+        The formatted line
+    """
+    if ctx is None: ctx = cfg.Context()
+    is_open, tail = set(), []
+
+    def replace(m) -> str:
+        token = m.group()
+        if token == '$date': return today
+        if token in ESCAPES: return ESCAPES[token]
+
+        # Hold back a run of markers at the end of the line, since closing
+        # markers added at the end of the line join it
+        run = MARKER_RUNS.get(token) or splitMarkerRun(token)
+        if m.end() == len(l):
+            tail.append(run)
+            return ''
+        return renderMarkerRun(run, is_open)
+
+    l = INLINE_MARKUP.sub(replace, l)
+    run = tail[0] if tail else None
+    if not is_open and run is None: return l
+
+    # Close any unbalanced formatters at the end of the line
+    for c, w, _, _ in FORMATTERS:
+        pending = run is not None and run[0] == c and run[1].count(w) % 2 == 1
+        if ((c, w) in is_open) != pending:
+            print('[WARN] Line {} does not have escaped formatter, escaping formatter at end of line'.format(ctx.line_no))
+            if run is None or run[0] != c:
+                if run: l += renderMarkerRun(run, is_open)
+                run = (c, (), '')
+            run = (c, tuple(sorted(run[1] + (w,), reverse=True)), run[2])
+
+    if run: l += renderMarkerRun(run, is_open)
     return l
 
 
-def textFormatter(text: str, old: str, new1: str, new2: str) -> str:
-    """Generic function that formats text
+def splitMarkerRun(token: str) -> tuple:
+    """Splits a run of formatter characters into markers, widest first
 
     Parameters
     ----------
-    text
-        Text to format
+    token
+        Run of a single formatter character, such as '*****'
+
+    Returns
+    -------
+    tuple
+        The formatter character, the widths of its markers in order, and any
+        characters left over that are not part of a marker
+    """
+    c, n, widths = token[0], len(token), ()
+    for w in MARKER_WIDTHS[c]:
+        widths += (w,) * (n // w)
+        n %= w
 
-    old
-        Symbol to look for
+    # Only short runs are worth remembering
+    run = (c, widths, c * n)
+    if len(token) <= 8: MARKER_RUNS[token] = run
+    return run
 
-    new1
-        Opening symbol that will replace
 
-    new2
-        Closing symbol that will replace
+def renderMarkerRun(run: tuple, is_open: set) -> str:
+    """Replaces a run of markers with opening or closing tags
+
+    Parameters
+    ----------
+    run
+        The run of markers, as returned by splitMarkerRun
+
+    is_open
+        Markers that have been opened and not yet closed
 
     Returns
     -------
     str
-        The new formatted text
+        The tags for the run of markers
     """
-    if text.find(old) != -1 and text.count(old) % 2 == 1:
-        text += old
-        print('[WARN] Line {} does not have escaped formatter, escaping formatter at end of line'.format(cfg.LINE_NO))
-    while text.find(old) != -1:
-        text = text.replace(old, new1, 1)
-        text = text.replace(old, new2, 1)
-    return text
+    c, widths, leftover = run
+    tags = ''
+    for w in widths:
+        if (c, w) in is_open:
+            tags += FORMATTER_TAGS[c, w][1]
+            is_open.remove((c, w))
+        else:
+            tags += FORMATTER_TAGS[c, w][0]
+            is_open.add((c, w))
+    return tags + leftover
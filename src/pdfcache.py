@@ -0,0 +1,144 @@
+from src.foldercache import FolderCache
+
+from datetime import date
+
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+
+# Folders whose files change how a document compiles
+ASSET_DIRS = ['themes', 'tmplt']
+
+# Seconds that assetVersion reuses its last look at the asset folders for, as
+# every note sent to the web app needs it
+ASSET_VERSION_TTL = 2
+
+_asset_version = (None, '') # (time.monotonic() of the last walk, version)
+_asset_version_lock = threading.Lock()
+
+def assetVersion() -> str:
+    """Fingerprints the themes, templates and their assets, along with today's
+    date since $date is compiled into the document. The folders are walked
+    again at most every ASSET_VERSION_TTL seconds.
+
+    Returns
+    -------
+    str
+        A string that changes whenever a compiled document could change
+    """
+    global _asset_version
+    with _asset_version_lock:
+        walked_at, version = _asset_version
+        now = time.monotonic()
+        if walked_at is not None and now - walked_at < ASSET_VERSION_TTL: return version
+
+        version = [str(date.today())]
+        for d in ASSET_DIRS:
+            for root, dirs, files in os.walk(d):
+                dirs.sort()
+                for f in sorted(files):
+                    path = os.path.join(root, f)
+                    version.append('{}:{}'.format(path, os.stat(path).st_mtime_ns))
+        _asset_version = (now, '\n'.join(version))
+        return _asset_version[1]
+
+
+def normalizeSource(code: str) -> str:
+    """ Normalizes line endings so the same note always has the same key """
+    return code.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def renderToFile(render, code: str, tmp_filename: str, filename: str) -> int:
+    """Renders a note to a temporary file, then moves it into place so a PDF is
+    never served half written
+
+    Parameters
+    ----------
+    render
+        Function called as render(code, out_file) to compile the note
+
+    code
+        The RNote source of the note
+
+    tmp_filename
+        Path that the PDF is rendered to
+
+    filename
+        Path that the PDF is moved to once it has been rendered
+
+    Returns
+    -------
+    int
+        Size of the PDF in bytes
+    """
+    try:
+        render(code, tmp_filename)
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename): os.remove(tmp_filename)
+    return os.path.getsize(filename)
+
+
+def renderToBytes(render, code: str, **options) -> bytes:
+    """ Renders a note in memory, calling render(code, out_file, **options) with a BytesIO """
+    pdf = io.BytesIO()
+    render(code, pdf, **options)
+    return pdf.getvalue()
+
+
+class PdfCache(FolderCache):
+    """Content-addressed LRU cache of compiled PDFs. PDFs are stored in a folder
+    under the hash of their source and the asset version, and the least
+    recently used are deleted once there are too many, they take up too much
+    space or they have not been used for max_age seconds. PDFs left in the
+    folder by an earlier process are adopted when the cache is created.
+    """
+    kind = 'PDF'
+
+    def __init__(self, directory: str, max_entries: int = 256, max_bytes: int = 256 * 1024 * 1024, max_age: float = 24 * 60 * 60):
+        super().__init__(directory, ('.pdf',), max_entries, max_bytes, max_idle=max_age)
+
+
+    def key(self, code: str) -> str:
+        """ Returns the cache key of a note """
+        digest = hashlib.sha256(normalizeSource(code).encode('utf-8'))
+        digest.update(b'\0' + assetVersion().encode('utf-8'))
+        return digest.hexdigest()
+
+
+    def path(self, key: str) -> str:
+        """ Returns the path to the PDF stored under a key """
+        return self.directory + '/' + key + '.pdf'
+
+
+    def get(self, key: str) -> str:
+        """ Returns the path to the PDF stored under a key, or None on a miss """
+        filename = self.path(key)
+        with self._lock:
+            if key in self.entries and os.path.exists(filename):
+                self._use(key, filename)
+                self.hits += 1
+                return filename
+            self.misses += 1
+        return None
+
+
+    def tempPath(self, key: str) -> str:
+        """ Returns a unique path to render the PDF of a key to before storing it """
+        return self.path(key + '.' + uuid.uuid4().hex)
+
+
+    def touch(self, key: str) -> bool:
+        """ Marks a stored PDF as used without counting a hit, returning False if it is not stored """
+        with self._lock:
+            if key not in self.entries: return False
+            self._use(key, self.path(key))
+            return True
+
+
+    def add(self, key: str, size: int):
+        """ Records a newly stored PDF, evicting old PDFs to stay within limits """
+        with self._lock: self._add(key, size)
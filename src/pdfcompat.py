@@ -0,0 +1,33 @@
+# PyPDF2 renamed most of its API in 2.0 and removed the old names in 3.0, while
+# the Pipfile pins 1.26.0 for xhtml2pdf. These helpers use the new names when
+# they are there and fall back to those of 1.26, so either version works
+def merger():
+    """ Returns a new PDF merger """
+    try: from PyPDF2 import PdfMerger
+    except ImportError: from PyPDF2 import PdfFileMerger as PdfMerger
+    return PdfMerger()
+
+
+def addMetadata(pdf, metadata: dict):
+    """ Sets the document information of a merger, such as its '/Title' """
+    if hasattr(pdf, 'add_metadata'): pdf.add_metadata(metadata)
+    else: pdf.addMetadata(metadata)
+
+
+def reader(stream):
+    """ Opens a PDF for reading, from a path or a readable binary file-like object """
+    try: from PyPDF2 import PdfReader
+    except ImportError: from PyPDF2 import PdfFileReader as PdfReader
+    return PdfReader(stream)
+
+
+def pageSize(page) -> (float, float):
+    """ Returns the width and height of a page in points """
+    if hasattr(page, 'mediabox'): return float(page.mediabox.width), float(page.mediabox.height)
+    return float(page.mediaBox.getWidth()), float(page.mediaBox.getHeight())
+
+
+def pageText(page) -> str:
+    """ Extracts the text of a page """
+    if hasattr(page, 'extract_text'): return page.extract_text()
+    return page.extractText()
@@ -0,0 +1,161 @@
+from src import flowables as flowables
+from src import generator as gen
+from src import parser as parser
+from src import styling as sty
+
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+# Pages a preview stops after when no other limit is given
+PREVIEW_PAGES = 2
+
+# Fraction of the pages a preview stops at. Heights are estimated from the
+# length of the text, which runs short of the real layout more often than not
+PAGE_FILL = 0.8
+
+# Rough heights of each kind of block in lines of body text, including margins
+BLOCK_LINES = {'h1': 3.5, 'h2': 3.0, 'h3': 2.5, 'p': 2.5, 'br': 1.0, 'hr': 1.0}
+
+# Indent of each level of bullets, in multiples of the font size
+BULLET_INDENT = 1.5
+
+# Average width of a character of body text, as a fraction of the font size
+CHAR_WIDTH = 0.5
+
+def textLines(text: str, style: sty.Styler, columns: int = 1, indent: float = 0.0) -> int:
+    """ Estimates how many lines of body text a line of the note wraps onto, in one of some number of columns or indented by some points """
+    width = style.width * gen.POINTS_PER_CM / columns - indent
+    chars_per_line = max(1.0, width / (flowables.BASE_FONT_SIZE * CHAR_WIDTH))
+    return max(1, math.ceil(len(text) / chars_per_line))
+
+
+def bulletHeight(bullet: str, style: sty.Styler) -> float:
+    """ Estimates the height in points of a bullet, which is narrower the more it is indented """
+    level = len(bullet) - len(bullet.lstrip('-'))
+    indent = level * BULLET_INDENT * flowables.BASE_FONT_SIZE
+    return textLines(bullet, style, indent=indent) * flowables.BASE_FONT_SIZE * flowables.LINE_HEIGHT
+
+
+def rowHeight(row: str, style: sty.Styler, columns: int) -> float:
+    """ Estimates the height in points of a table row, from its longest cell. Cells are padded, so each line counts as a whole row """
+    return gen.TABLE_ROW_HEIGHT * max(textLines(cell, style, columns) for cell in row[2:].split(';'))
+
+
+def blockHeight(l: str, style: sty.Styler) -> float:
+    """Estimates the height in points of a block without its rows, from its
+    first line. Rows of tables and bullet lists are counted as they are read.
+    """
+    line = flowables.BASE_FONT_SIZE * flowables.LINE_HEIGHT
+    if l.startswith('.pp'): return 0.0
+    elif l.startswith('$table'): return rowHeight(l, style, len(l.split(';')))
+    elif l.startswith(('$wi', '$li')): return parser.placeholderSize(style)[1] * gen.POINTS_PER_CM
+    elif l.startswith('$'): return BLOCK_LINES['br'] * line
+    elif l.startswith('# '): return BLOCK_LINES['h1'] * line
+    elif l.startswith('@ '): return BLOCK_LINES['h2'] * line
+    elif l.startswith('! '): return BLOCK_LINES['h3'] * line
+    elif l.startswith('-'): return bulletHeight(l, style)
+    return (BLOCK_LINES['p'] - 1 + textLines(l, style)) * line
+
+
+class PreviewBlocks:
+    """Passes on the blocks of a document from splitBlocks until roughly enough
+    content for max_pages pages or max_blocks blocks has been read. Tables and
+    bullet lists are cut off part way once the pages are full, so a preview
+    never reads more of the note than it shows.
+    """
+    def __init__(self, blocks, style: sty.Styler, max_pages: float = None, max_blocks: int = None):
+        self.blocks = blocks
+        self.style = style
+        self.max_pages = max_pages
+        self.max_blocks = max_blocks
+        self.pages = 0.0
+        self.count = 0
+        self.truncated = False
+
+
+    def full(self) -> bool:
+        """ Checks if the preview has all the content it will show """
+        if self.max_pages is not None and self.pages >= self.max_pages * PAGE_FILL: return True
+        return self.max_blocks is not None and self.count >= self.max_blocks
+
+
+    def add(self, height: float):
+        """ Counts a block or row of some height in points towards the pages """
+        self.pages += height / (self.style.height * gen.POINTS_PER_CM)
+
+
+    def rows(self, rows, columns: int = None):
+        """ Passes on the rows of a table with some number of columns, or of a bullet list, until the pages are full """
+        for r in rows:
+            if self.full():
+                self.truncated = True
+                return
+            self.add(bulletHeight(r, self.style) if columns is None else rowHeight(r, self.style, columns))
+            yield r
+
+
+    def __iter__(self):
+        for line_no, block in self.blocks:
+            if self.full():
+                self.truncated = True
+                return
+            rows = iter(block)
+            l = next(rows)
+            self.add(blockHeight(l, self.style))
+            self.count += 1
+            if l.startswith('$table'): block = (l,) + tuple(self.rows(rows, len(l.split(';'))))
+            elif l.startswith('-'): block = (l,) + tuple(self.rows(rows))
+            yield line_no, block
+
+            # Stop before the rest of a cut off table is read
+            if self.truncated: return
+
+
+def buildPreview(doc, style: sty.Styler, document, max_pages: float = None, max_blocks: int = None):
+    """Parses the start of a document into a draft preview. Parsing stops once
+    there is roughly enough content for max_pages pages, or after max_blocks
+    blocks, so previews take about as long however long the note is. Web
+    images are not downloaded and are drawn as placeholder boxes instead, and
+    the preview is marked as a draft.
+
+    Parameters
+    ----------
+    doc
+        Iterable of lines from the input document, such as an open file
+
+    style
+        Styler object containing style information about the document
+
+    document
+        The document model that parsed blocks are added to, such as a
+        gen.HtmlDocument or flowables.FlowableDocument
+
+    max_pages
+        Pages of content to stop after, defaults to PREVIEW_PAGES if max_blocks
+        is not given either
+
+    max_blocks
+        Blocks to stop after
+
+    Returns
+    -------
+    gen.HtmlDocument or flowables.FlowableDocument
+        The document model with the start of the input document added
+    """
+    ctx = style.ctx
+    ctx.preview = True
+    if max_pages is None and max_blocks is None: max_pages = PREVIEW_PAGES
+
+    document.addElement('p', '<i>Draft preview</i>')
+    blocks = PreviewBlocks(parser.splitBlocks(doc, lazy=True, ctx=ctx), style, max_pages, max_blocks)
+    for line_no, block in blocks:
+        ctx.line_no = line_no
+        document = parser.parseBlock(block, style, document)
+
+    if blocks.truncated:
+        log.info('Stopped the preview after %s blocks, around %.1f pages', blocks.count, blocks.pages)
+        document.addElement('p', '<i>Draft preview ends here, the rest of the note was not compiled</i>')
+    document.title = '[DRAFT] ' + document.title.strip()
+    return document
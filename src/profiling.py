@@ -0,0 +1,102 @@
+import contextlib
+import cProfile
+import time
+import tracemalloc
+
+class Profiler:
+    """Collects the wall time and call count of each phase of a compile. Phases
+    may be nested, in which case time spent in the inner phase is also counted
+    in the outer phase's total but not in its own time.
+    """
+    def __init__(self, cprofile_file: str = None, memory: bool = False):
+        self.cprofile_file = cprofile_file
+        self.memory = memory
+        self.phases = {} # {name: [calls, total seconds, own seconds]}
+        self.peak_memory = None
+        self.wall_time = None
+        self._stack = [] # [[name, start, seconds spent in inner phases]]
+        self._cprofile = None
+        self._start = None
+
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """ Times everything run inside the with block as the named phase """
+        frame = [name, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try: yield
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            self._stack.pop()
+            if self._stack: self._stack[-1][2] += elapsed
+
+            totals = self.phases.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] += elapsed - frame[2]
+
+
+    def timed(self, name: str, iterable):
+        """ Yields the items of an iterable, timing each one fetched as the named phase """
+        items = iter(iterable)
+        while True:
+            with self.phase(name):
+                try: item = next(items)
+                except StopIteration: return
+            yield item
+
+
+    def start(self):
+        """ Starts measuring the whole compile, along with cProfile and memory if asked for """
+        if self.memory: tracemalloc.start()
+        if self.cprofile_file:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._start = time.perf_counter()
+
+
+    def stop(self):
+        """ Stops measuring and writes the cProfile stats if asked for """
+        self.wall_time = time.perf_counter() - self._start
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.cprofile_file)
+            self._cprofile = None
+        if self.memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+    def stats(self) -> dict:
+        """ Returns the measurements as a dict that can be saved as JSON """
+        return {
+            'wall_time': self.wall_time,
+            'peak_memory': self.peak_memory,
+            'phases': {name: {'calls': c, 'total': t, 'own': o} for name, (c, t, o) in self.phases.items()}
+        }
+
+
+    def report(self) -> str:
+        """Formats the measurements as a table, slowest phases first
+
+        Returns
+        -------
+        str
+            The report, ready to be printed
+        """
+        lines = ['{:<20} {:>9} {:>11} {:>11}'.format('Phase', 'Calls', 'Total (s)', 'Own (s)')]
+        for name, (calls, total, own) in sorted(self.phases.items(), key=lambda p: -p[1][2]):
+            lines.append('{:<20} {:>9} {:>11.4f} {:>11.4f}'.format(name, calls, total, own))
+        if self.wall_time is not None: lines.append('Wall time: {:.4f} seconds'.format(self.wall_time))
+        if self.peak_memory is not None: lines.append('Peak memory: {:.1f} MB'.format(self.peak_memory / (1024 * 1024)))
+        if self.cprofile_file: lines.append('cProfile stats written to {}'.format(self.cprofile_file))
+        return '\n'.join(lines)
@@ -0,0 +1,275 @@
+from src import pdfcache
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import functools
+import multiprocessing
+import threading
+import uuid
+
+class QueueFull(Exception):
+    """ Raised when too many renders are already waiting for a worker """
+
+
+class NoteRejected(Exception):
+    """ Raised when a note is larger than the queue will render """
+
+
+class RenderFailed(Exception):
+    """ Raised when a render ran out of time or memory, or its process died """
+
+
+def renderProcess(conn, max_memory: int, func, *args):
+    """Runs a render in its own process, sending back (True, result) or (False,
+    error) through a pipe. Address space is limited to max_memory bytes, so a
+    render that grows too large fails with a MemoryError instead of starving
+    the machine.
+    """
+    if max_memory:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+    try: conn.send((True, func(*args)))
+    except BaseException as e: conn.send((False, '{}: {}'.format(type(e).__name__, e)))
+    finally: conn.close()
+
+
+def runIsolated(mp_context, timeout: float, max_memory: int, func, *args):
+    """Calls func(*args) in a new process, killing it if it runs for longer than
+    timeout seconds
+
+    Parameters
+    ----------
+    mp_context
+        Multiprocessing context the process is started from
+
+    timeout
+        Seconds the call may take, or None for no limit
+
+    max_memory
+        Bytes of address space the process may use, or None for no limit
+
+    func
+        The function to call, which must be picklable, as must its arguments
+        and result
+
+    Returns
+    -------
+    The result of the call
+
+    Raises
+    ------
+    RenderFailed
+        If the call raised, took too long or its process died
+    """
+    recv, send = mp_context.Pipe(duplex=False)
+    process = mp_context.Process(target=renderProcess, args=(send, max_memory, func) + args, daemon=True)
+    process.start()
+    send.close()
+    try:
+        if not recv.poll(timeout):
+            process.kill()
+            raise RenderFailed('Render took longer than {} seconds'.format(timeout))
+        try: ok, result = recv.recv()
+        except EOFError:
+            process.join()
+            raise RenderFailed('Render process exited with code {}'.format(process.exitcode))
+        if not ok: raise RenderFailed(result)
+        return result
+    finally:
+        process.join()
+        recv.close()
+
+
+def countImages(code: str) -> int:
+    """ Counts the $wi and $li commands of a note """
+    return sum(1 for l in code.splitlines() if l.lstrip().startswith(('$wi', '$li')))
+
+
+class RenderQueue:
+    """Renders notes in worker processes so requests never wait on pisa. Each
+    submitted note gets a job id that can be polled for its status, and
+    finished PDFs are stored in a PdfCache.
+
+    Notes larger than the size, line or image limits are rejected up front.
+    Every render runs in its own process with a time and memory budget, and
+    is killed once it runs out of time, so one bad note only fails itself.
+    Processes are forked from a forkserver that has the preload modules
+    imported already, so they start warm.
+    """
+    def __init__(self, cache: pdfcache.PdfCache, render, max_workers: int = 2, max_pending: int = 8, max_jobs: int = 1024,
+            max_bytes: int = None, max_lines: int = None, max_images: int = None, timeout: float = None, max_memory: int = None,
+            preload: [str] = ()):
+        self.cache = cache
+        self.render = render
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_jobs = max_jobs
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.max_images = max_images
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.preload = list(preload)
+        self.jobs = OrderedDict() # {job id: {'key', 'pdf', 'future'}}
+        self.pending = {} # {cache key: job id}
+        self.in_memory = set() # Futures of renders that return the PDF instead of caching it
+        self._pool = None
+        self._mp_context = None
+        self._lock = threading.Lock()
+
+
+    def admit(self, code: str):
+        """Checks that a note is within the limits of the queue
+
+        Parameters
+        ----------
+        code
+            The RNote source of the note
+
+        Raises
+        ------
+        NoteRejected
+            If the note has too many bytes, lines or images
+        """
+        if self.max_bytes is not None and len(code.encode('utf-8')) > self.max_bytes:
+            raise NoteRejected('Notes may be at most {} bytes long'.format(self.max_bytes))
+        if self.max_lines is not None and code.count('\n') + 1 > self.max_lines:
+            raise NoteRejected('Notes may be at most {} lines long'.format(self.max_lines))
+        if self.max_images is not None and countImages(code) > self.max_images:
+            raise NoteRejected('Notes may have at most {} images'.format(self.max_images))
+
+
+    def _submit(self, func, *args):
+        """ Runs a render in its own process once a worker is free, starting the workers if needed """
+        # Start the workers lazily, so the forkserver is started by the serving process
+        if self._pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._mp_context = multiprocessing.get_context(method)
+            if method == 'forkserver' and self.preload: self._mp_context.set_forkserver_preload(self.preload)
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._pool.submit(runIsolated, self._mp_context, self.timeout, self.max_memory, func, *args)
+
+
+    def submit(self, code: str) -> str:
+        """Queues a note to be rendered
+
+        Parameters
+        ----------
+        code
+            The RNote source of the note
+
+        Returns
+        -------
+        str
+            The id of the job rendering the note. Notes that are already cached
+            get a job that is already done, and notes that are already being
+            rendered share the same job.
+
+        Raises
+        ------
+        NoteRejected
+            If the note is larger than the limits of the queue
+
+        QueueFull
+            If max_pending notes are already waiting to be rendered
+        """
+        key = self.cache.key(code)
+        filename = self.cache.get(key)
+        if filename is None: self.admit(code)
+
+        with self._lock:
+            if filename is None and key in self.pending: return self.pending[key]
+
+            job_id = uuid.uuid4().hex
+            job = {'key': key, 'pdf': filename, 'future': None}
+            if filename is None:
+                if len(self.pending) + len(self.in_memory) >= self.max_pending:
+                    raise QueueFull('{} renders are already queued'.format(len(self.pending) + len(self.in_memory)))
+
+                job['pdf'] = self.cache.path(key)
+                job['future'] = self._submit(pdfcache.renderToFile, self.render, code, self.cache.tempPath(key), job['pdf'])
+                self.pending[key] = job_id
+
+            self.jobs[job_id] = job
+            while len(self.jobs) > self.max_jobs: self.jobs.popitem(last=False)
+
+        if job['future'] is not None: job['future'].add_done_callback(lambda f: self._finish(job_id, key, f))
+        return job_id
+
+
+    def renderBytes(self, code: str, **options):
+        """Queues a note to be rendered in memory, without storing it in the cache
+
+        Parameters
+        ----------
+        code
+            The RNote source of the note
+
+        options
+            Keyword arguments passed on to the render function, such as preview_pages
+
+        Returns
+        -------
+        Future
+            Resolves to the bytes of the PDF
+
+        Raises
+        ------
+        NoteRejected
+            If the note is larger than the limits of the queue
+
+        QueueFull
+            If max_pending notes are already waiting to be rendered
+        """
+        self.admit(code)
+        with self._lock:
+            if len(self.pending) + len(self.in_memory) >= self.max_pending:
+                raise QueueFull('{} renders are already queued'.format(len(self.pending) + len(self.in_memory)))
+            future = self._submit(functools.partial(pdfcache.renderToBytes, **options), self.render, code)
+            self.in_memory.add(future)
+        future.add_done_callback(self._finishBytes)
+        return future
+
+
+    def _finishBytes(self, future):
+        """ Stops counting an in-memory render as pending once it is done """
+        with self._lock: self.in_memory.discard(future)
+
+
+    def _finish(self, job_id: str, key: str, future):
+        """ Stores a rendered PDF in the cache once its job is done """
+        with self._lock:
+            if self.pending.get(key) == job_id: del self.pending[key]
+        if not future.cancelled() and future.exception() is None: self.cache.add(key, future.result())
+
+
+    def status(self, job_id: str, timeout: float = 0) -> dict:
+        """Gets the status of a job, optionally waiting for it to finish
+
+        Parameters
+        ----------
+        job_id
+            The id returned by submit
+
+        timeout
+            Seconds to wait for the job to finish before returning
+
+        Returns
+        -------
+        dict
+            The status of the job, one of 'queued', 'running', 'done' or
+            'failed', along with the path to its PDF once it is done or the
+            error if it failed. None if there is no such job.
+        """
+        with self._lock: job = self.jobs.get(job_id)
+        if job is None: return None
+
+        future = job['future']
+        if future is None: return {'status': 'done', 'pdf': job['pdf']}
+        if timeout > 0: wait([future], timeout=timeout)
+
+        if not future.done(): return {'status': 'running' if future.running() else 'queued'}
+        if future.cancelled(): return {'status': 'failed', 'error': 'Render was cancelled'}
+        if future.exception() is not None: return {'status': 'failed', 'error': str(future.exception())}
+        return {'status': 'done', 'pdf': job['pdf']}
@@ -0,0 +1,9 @@
+# Preloaded by the forkserver that web renders are forked from. Everything
+# loaded here is inherited by every render, so each one starts with the themes,
+# templates, page geometry, renderer and image cache already in memory, rather
+# than loading them again in a fresh process
+import rnote_for_webapp as rnote
+from src import imagecache as imagecache
+
+rnote.COMPILER.preload()
+imagecache.sharedCache()
@@ -0,0 +1,97 @@
+from src import generator as gen
+from src import imagecache as imagecache
+from src import parser as parser
+from src import pdfcompat as pdfcompat
+from src import styling as sty
+
+import os
+import tempfile
+
+def splitRNoteDoc(doc, style: sty.Styler, section_blocks: int = 100) -> [gen.HtmlDocument]:
+    """Parses an input document into several HTML documents that can be
+    rendered on their own. A new section starts at the first ! header after
+    the current one has section_blocks blocks, or after twice that many blocks
+    if no header comes. Every section shares the styler, so they all get the
+    theme and page settings of the whole document.
+
+    Parameters
+    ----------
+    doc
+        Iterable of lines from the input document, such as an open file
+
+    style
+        Styler object containing style information about the document
+
+    section_blocks
+        Number of blocks a section has before it is ended at a ! header
+
+    Returns
+    -------
+    [gen.HtmlDocument]
+        The sections in order, each titled with the title of the whole document
+    """
+    ctx = style.ctx
+    sections = [gen.generateHtmlHeader(style)]
+    blocks = 0
+
+    for line_no, block in parser.splitBlocks(doc, ctx=ctx):
+        ctx.line_no = line_no
+        if blocks >= section_blocks and (block[0].startswith('! ') or blocks >= 2 * section_blocks):
+            sections.append(gen.generateHtmlHeader(style))
+            blocks = 0
+        parser.parseBlock(block, style, sections[-1])
+        blocks += 1
+
+    # .pp title adds to the title of whichever section it is in
+    title = ''.join(s.title for s in sections)
+    for s in sections: s.title = title
+    return sections
+
+
+def renderSection(raw_html: str, theme: str, images: dict, out_file: str) -> bool:
+    """ Renders one section into a PDF, run in a worker process """
+    with open(out_file, 'wb') as f: return not gen.renderHtml(raw_html, theme, images, f).err
+
+
+def convertSectionsToPdf(sections: [gen.HtmlDocument], style: sty.Styler, out_file: str, jobs: int = None) -> bool:
+    """Renders sections in parallel worker processes, then merges them in order
+    into a single PDF. Each section starts on a new page.
+
+    Parameters
+    ----------
+    sections
+        Sections of the document, as returned by splitRNoteDoc
+
+    style
+        Styler object that contains CSS rules for the HTML document
+
+    out_file
+        Path to the new PDF document, or a writable binary file-like object
+
+    jobs
+        Number of worker processes, defaults to the number of CPUs
+
+    Returns
+    -------
+    bool
+        True if every section rendered successfully, False otherwise
+    """
+    ctx = style.ctx
+    with ctx.phase('images'): images = imagecache.waitFor(ctx.images)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with ctx.phase('render'):
+            args = [(s.getvalue(), style.theme, images, os.path.join(tmp_dir, '{}.pdf'.format(i))) for i, s in enumerate(sections)]
+            if len(args) == 1 or (jobs is not None and jobs <= 1): results = [renderSection(*a) for a in args]
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=jobs) as pool:
+                    results = list(pool.map(renderSection, *zip(*args)))
+
+        with ctx.phase('merge'):
+            merged = pdfcompat.merger()
+            for a in args: merged.append(a[3])
+            pdfcompat.addMetadata(merged, {'/Title': sections[0].title.strip(), '/Author': 'RNote Compiler'})
+            merged.write(out_file)
+            merged.close()
+    return all(results)
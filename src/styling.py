@@ -1,40 +1,105 @@
 from src import pagedimensions as pd
-import tinycss
+from src import cfg
+
+from typing import NamedTuple
+
+import functools
 import os
 
+# Themes loaded by this process as {path: (modification time, stylesheet)}
+THEMES = {}
+
+def themePath(theme_fn: str) -> str:
+    """ Returns the path to the stylesheet of a theme """
+    return "themes/" + theme_fn + '/' + theme_fn + ".css"
+
+
+def loadTheme(theme_fn: str) -> str:
+    """Loads a theme's stylesheet from the themes/ folder. Each theme is read and
+    validated once per process, and again only if its file has changed.
+
+    Parameters
+    ----------
+    theme_fn
+        Name of the theme
+
+    Returns
+    -------
+    str
+        The stylesheet of the theme, or None if the theme could not be found
+    """
+    filename = themePath(theme_fn)
+    try: mtime = os.stat(filename).st_mtime_ns
+    except OSError: return None
+
+    cached = THEMES.get(filename)
+    if cached is not None and cached[0] == mtime: return cached[1]
+
+    # Open and read the new themesheet from the themes/ folder
+    with open(filename, "r") as f: new_theme = f.read()
+
+    # Validate the CSS for the document before caching it
+    import tinycss
+    verifier = tinycss.make_parser('page3')
+    verifier.parse_stylesheet(new_theme)
+    THEMES[filename] = (mtime, new_theme)
+    return new_theme
+
+
+class PageGeometry(NamedTuple):
+    """ Size of the page and of the frame the document is laid out in, all in cm, along with the @page styling for them """
+    page_width: float
+    page_height: float
+    top: float
+    left: float
+    width: float
+    height: float
+    css: str
+
+
+@functools.lru_cache(maxsize=None)
+def pageGeometry(pagesize: str, orientation: str, margin: str) -> PageGeometry:
+    """Works out the page and frame of a page size, orientation and margin. Each
+    combination is only worked out once per process.
+
+    Parameters
+    ----------
+    pagesize
+        Name of the page size, one of pagedimensions.PAGE_SIZES
+
+    orientation
+        Either 'portrait' or 'landscape'
+
+    margin
+        Name of the margins, one of pagedimensions.MARGINS
+
+    Returns
+    -------
+    PageGeometry
+        The size of the page and of its frame
+    """
+    page = pd.PAGE_SIZES[pagesize]
+    page_width, page_height = (page.height, page.width) if orientation == 'landscape' else (page.width, page.height)
+    top, left = pd.MARGINS[margin]
+    width, height = page_width - (2 * left), page_height - (2 * top)
+    css = 'size: {} {}; @frame {{top: {}cm; left: {}cm; height: {}cm; width: {}cm;}}'.format(pagesize, orientation, top, left, height, width)
+    return PageGeometry(page_width, page_height, top, left, width, height, css)
+
+
 class Styler:
-    def __init__(self):
-        self.pageDim = {
-            # Sizes ordered as WxH in cm
-            'a0': pd.PageDimensions(84.1, 118.9),
-            'a1': pd.PageDimensions(59.4, 84.1),
-            'a2': pd.PageDimensions(42.0, 59.4),
-            'a3': pd.PageDimensions(29.7, 42.0),
-            'a4': pd.PageDimensions(21.0, 29.7),
-            'a5': pd.PageDimensions(14.8, 21.0),
-            'a6': pd.PageDimensions(10.5, 14.8),
-            'b0': pd.PageDimensions(100.0, 141.4),
-            'b1': pd.PageDimensions(59.4, 84.1),
-            'b2': pd.PageDimensions(42.0, 59.4),
-            'b3': pd.PageDimensions(29.7, 42.0),
-            'b4': pd.PageDimensions(21.0, 29.7),
-            'b5': pd.PageDimensions(14.8, 21.0),
-            'b6': pd.PageDimensions(10.5, 14.8),
-            'elevenseventeen': pd.PageDimensions(27.94, 43.1),
-            'legal': pd.PageDimensions(21.59, 35.56),
-            'letter': pd.PageDimensions(21.59, 27.94)
-        }
+    # Page sizes shared by every Styler, ordered as WxH in cm
+    pageDim = pd.PAGE_SIZES
+
+    def __init__(self, ctx: cfg.Context = None):
+        self.ctx = ctx if ctx is not None else cfg.Context()
         self.theme = 'simple'
-        self.margin = 'normal'
-        self.top = 2.0
-        self.left = 2.0
-        self.pagesize = 'letter'
-        self.orientation = 'portrait' # One of ['portrait', 'landscape']
+        self._margin = 'normal'
+        self._pagesize = 'letter'
+        self._orientation = 'portrait' # One of ['portrait', 'landscape']
+        self._geometry = pageGeometry(self._pagesize, self._orientation, self._margin)
         self.pgnum = False
         self.title = 'New Document'
         self.template = ''
-        self.width
-        self.height
 
 
     @property
@@ -44,21 +109,12 @@ class Styler:
     @theme.setter
     def theme(self, theme_fn):
         """ Sets a new theme for the document """
-        # Check if the file passed in exists
-        filename = "themes/" + theme_fn + '/' + theme_fn + ".css"
-        if (os.path.exists(filename) == False):
-            print("[PARSER_ERR] Could not find theme file '{}'. Please make sure that the theme is in the theme/ folder. Falling back on default theme.".format(filename))
+        # Load the theme, checking that it exists
+        with self.ctx.phase('theme'): new_theme = loadTheme(theme_fn)
+        if new_theme is None:
+            print("[PARSER_ERR] Could not find theme file '{}'. Please make sure that the theme is in the theme/ folder. Falling back on default theme.".format(themePath(theme_fn)))
             return
-
-        # Open and read the new themesheet from the themes/ folder
-        f = open(filename, "r")
-        new_theme = f.read()
-        f.close()
-
-        # Validate the CSS for the document and set the CSS if it is valid
-        verifier = tinycss.make_parser('page3')
-        parsed_contents = verifier.parse_stylesheet(new_theme)
-        self._theme = new_theme              
+        self._theme = new_theme
 
     @property
     def margin(self):
@@ -68,24 +124,7 @@ class Styler:
     def margin(self, new_margin):
         """ Sets a new margin """
         self._margin = new_margin
-
-    @property
-    def top(self):
-        return self._top
-
-    @top.setter
-    def top(self, new_TB):
-        """ Sets new top value """
-        self._top = new_TB
-
-    @property
-    def left(self):
-        return self._left
-
-    @left.setter
-    def left(self, new_LR):
-        """ Sets new left value """
-        self._left = new_LR
+        self._geometry = pageGeometry(self._pagesize, self._orientation, self._margin)
 
     @property
     def pagesize(self):
@@ -95,8 +134,7 @@ class Styler:
     def pagesize(self, new_pagesize):
         """ Sets a new pagesize """
         self._pagesize = new_pagesize
-        self._height = 1
-        self._width = 1
+        self._geometry = pageGeometry(self._pagesize, self._orientation, self._margin)
 
     @property
     def orientation(self):
@@ -106,6 +144,7 @@ class Styler:
     def orientation(self, new_orientation):
         """ Sets a new orientation for the document """
         self._orientation = new_orientation
+        self._geometry = pageGeometry(self._pagesize, self._orientation, self._margin)
 
     @property
     def pgnum(self):
@@ -135,33 +174,22 @@ class Styler:
         self._template = new_template
 
     @property
-    def width(self):
-        return self._width
-
-    @width.setter
-    def width(self, a):
-        """ Sets the width of the document based on orientation """
-        if self._orientation == 'portrait':
-            page_width = (self.pageDim[self._pagesize]).width
-            self._width = page_width - (2 * self._left)
-        if self._orientation == 'landscape':
-            page_height = (self.pageDim[self._pagesize]).height
-            self._width = page_height - (2 * self._top)
-
-            
+    def geometry(self) -> PageGeometry:
+        """ The page and frame for the page size, orientation and margin """
+        return self._geometry
+
     @property
-    def height(self):
-        return self._height
-    
-    @height.setter
-    def height(self, a):
-        """ Sets the height of the document based on orientation """
-        if self._orientation == 'portrait':
-            page_height = (self.pageDim[self._pagesize]).height
-            self._height = page_height - (2 * self._top)
-        if self._orientation == 'landscape':
-            page_width = (self.pageDim[self._pagesize]).width
-            self._height = page_width - (2 * self._left)
+    def top(self):
+        return self._geometry.top
 
-    
+    @property
+    def left(self):
+        return self._geometry.left
 
+    @property
+    def width(self):
+        return self._geometry.width
+
+    @property
+    def height(self):
+        return self._geometry.height
@@ -0,0 +1,84 @@
+from src import batch as batch
+from src import generator as gen
+from src import parser as parser
+from src import styling as sty
+
+from datetime import date
+
+import os
+import time
+
+def snapshot(paths: [str]) -> dict:
+    """ Returns the modification time of each path, or None if it is missing """
+    mtimes = {}
+    for p in paths:
+        try: mtimes[p] = os.stat(p).st_mtime_ns
+        except OSError: mtimes[p] = None
+    return mtimes
+
+
+class Watcher:
+    """Recompiles a document whenever it or a file it uses changes. Blocks that
+    have not changed reuse their HTML from the last compile, and the PDF is only
+    rendered again if the HTML or theme changed.
+    """
+    def __init__(self, in_file: str, out_file: str):
+        self.in_file = in_file
+        self.out_file = out_file
+        self.fragments = {}
+        self.mtimes = {}
+        self.last_output = None
+        self.last_date = None
+
+
+    def changed(self) -> bool:
+        """ Checks if the document or anything it uses changed since last checked """
+        mtimes = snapshot(batch.dependencies(self.in_file))
+        if mtimes == self.mtimes: return False
+        self.mtimes = mtimes
+        return True
+
+
+    def compile(self) -> bool:
+        """Compiles the document, reusing what it can from the last compile
+
+        Returns
+        -------
+        bool
+            True if the PDF was rendered, False if the output would not change
+        """
+        # Blocks using $date go stale at midnight
+        if self.last_date != date.today(): self.fragments.clear()
+        self.last_date = date.today()
+
+        style = sty.Styler()
+        raw_html = gen.generateHtmlHeader(style)
+        with open(self.in_file) as f: doc = [line.rstrip('\n') for line in f]
+        raw_html = parser.parseRNoteDoc(doc, style, raw_html, self.fragments)
+
+        # Images are only named in the HTML, so the files the document uses are
+        # compared too, or an edited image would never be rendered again
+        output = (raw_html, style.theme, {p: m for p, m in self.mtimes.items() if p != self.in_file})
+        if output == self.last_output: return False
+        gen.convertHtmlToPdf(raw_html, style, self.out_file)
+        self.last_output = output
+        return True
+
+
+    def run(self, interval: float = 0.25):
+        """ Polls for changes and recompiles until interrupted """
+        print('[RNOTE] Watching {} for changes, press Ctrl+C to stop'.format(self.in_file))
+        try:
+            while True:
+                if self.changed():
+                    start_time = time.time()
+                    # Mistakes in the note are reported and left for the next save to fix
+                    try:
+                        if not os.path.exists(self.in_file): print('[WARN] Input file is missing, waiting for it to return')
+                        elif self.compile(): print('[RNOTE] Rebuilt {} in {:.4f} seconds'.format(self.out_file, time.time() - start_time))
+                        else: print('[RNOTE] No changes to the output of {} ({:.4f} seconds)'.format(self.in_file, time.time() - start_time))
+                    except Exception as e:
+                        print('[ERR!] Could not compile {}: {}: {}'.format(self.in_file, type(e).__name__, e))
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print('[RNOTE] Stopped watching {}'.format(self.in_file))